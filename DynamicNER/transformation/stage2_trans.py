@@ -1,51 +1,16 @@
 import json
 import os
+import sys
 from pathlib import Path
 
-def load_json_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from category_hierarchy import load_category_hierarchy
 
-def load_category_structure(file_path):
+def load_json_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         return json.load(file)
 
-def find_categories(category, category_structure):
-    for second, third_list in category_structure['third-level'].items():
-        if category in third_list.split(', '):
-            third_level = category
-            second_level = second
-            for first, second_list in category_structure['second-level'].items():
-                if second in second_list.split(', '):
-                    first_level = first
-                    return first_level, second_level, third_level
-    
-    for first, second_list in category_structure['second-level'].items():
-        if category in second_list.split(', '):
-            first_level = first
-            second_level = category
-            return first_level, second_level, category
-    
-    if category in category_structure['first-level'].split(', '):
-        return category, category, category
-    
-    return 'miscellaneous', 'miscellaneous', 'miscellaneous'
-
-def get_entity_list(level, category, category_structure):
-    if level == 'first-level':
-        return category_structure['first-level']
-    elif level == 'second-level':
-        for first, second_list in category_structure['second-level'].items():
-            if category in second_list.split(', '):
-                return second_list
-        return category_structure['second-level'].get(category, '')
-    elif level == 'third-level':
-        for second, third_list in category_structure['third-level'].items():
-            if category in third_list.split(', '):
-                return third_list
-    return ''
-
-def convert_to_complex_conversation_format(json_data, category_structure):
+def convert_to_complex_conversation_format(json_data, hierarchy):
     conversation_data = []
     
     for sentence_id, sentence_info in json_data.items():
@@ -54,10 +19,10 @@ def convert_to_complex_conversation_format(json_data, category_structure):
         categories = sentence_info['category']
         
         for i, (entity, category) in enumerate(zip(entities, categories)):
-            first_level, second_level, third_level = find_categories(category, category_structure)
+            first_level, second_level, third_level = hierarchy.find_path(category)
             
             for level, category_value in [('first-level', first_level), ('second-level', second_level), ('third-level', third_level)]:
-                entity_list = get_entity_list(level, category_value, category_structure)
+                entity_list = hierarchy.entity_list(level, category_value)
                 
                 # Create a copy of the sentence and highlight the current entity
                 highlighted_sentence = sentence
@@ -95,7 +60,7 @@ def write_json_file(data, output_file):
         json.dump(data, file, ensure_ascii=False, indent=2)
 
 def process_directory(input_dir, category_structure_file, output_dir):
-    category_structure = load_category_structure(category_structure_file)
+    hierarchy = load_category_hierarchy(category_structure_file)
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     
     for filename in os.listdir(input_dir):
@@ -104,7 +69,7 @@ def process_directory(input_dir, category_structure_file, output_dir):
             output_file = os.path.join(output_dir, f"{filename}")
             
             json_data = load_json_file(input_file)
-            conversation_data = convert_to_complex_conversation_format(json_data, category_structure)
+            conversation_data = convert_to_complex_conversation_format(json_data, hierarchy)
             write_json_file(conversation_data, output_file)
             print(f"Processed {filename}. Output written to {output_file}")
 
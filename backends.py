@@ -0,0 +1,425 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+
+from batching import PaddingStats, bucket_batches
+from category_hierarchy import load_category_hierarchy
+from lazy import lazy_pair
+from prefix_cache import PrefixKVCache, to_legacy
+from telemetry import metrics
+
+BACKENDS = ("hf", "lmdeploy", "fake")
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+def chat_messages(query):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": query}
+    ]
+
+def load_model_and_tokenizer(local_model_path, device):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    if str(device).startswith("cuda"):
+        model = AutoModelForCausalLM.from_pretrained(
+            local_model_path,
+            torch_dtype=torch.float16,
+            device_map="auto"
+        )
+    else:
+        # fp16 kernels are missing or slow on CPU
+        model = AutoModelForCausalLM.from_pretrained(local_model_path, torch_dtype=torch.float32).to(device)
+    tokenizer = AutoTokenizer.from_pretrained(local_model_path)
+    # batched generation pads on the left, set once here rather than per call
+    # since the tokenizer is shared by every thread using the backend
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return model, tokenizer
+
+class BackendStats:
+    # Per-backend totals; every model call is also reported to telemetry.
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, prompts, prompt_tokens, generated_tokens, seconds, kind="generate"):
+        with self.lock:
+            self.calls += 1
+            self.prompts += prompts
+            self.prompt_tokens += prompt_tokens
+            self.generated_tokens += generated_tokens
+        metrics.inc("model_calls_total", backend=self.name, kind=kind)
+        metrics.inc("model_prompts_total", prompts, backend=self.name, kind=kind)
+        metrics.inc("model_prompt_tokens_total", prompt_tokens, backend=self.name, kind=kind)
+        metrics.inc("model_generated_tokens_total", generated_tokens, backend=self.name, kind=kind)
+        metrics.observe("model_call_seconds", seconds, backend=self.name, kind=kind)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "prompts": self.prompts,
+            "prompt_tokens": self.prompt_tokens,
+            "generated_tokens": self.generated_tokens,
+        }
+
+class Backend:
+    # What the pipeline needs from a model: batched generation, single-query
+    # generation, several samples per query and, for mode="score", ranking
+    # candidate labels.
+    name = None
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.counters = BackendStats(self.name)
+
+    def generate(self, queries, batch_size=8, max_batch_tokens=4096, max_new_tokens=512):
+        raise NotImplementedError
+
+    def generate_one(self, query, max_new_tokens=512):
+        return self.generate([query], 1, max_new_tokens=max_new_tokens)[0]
+
+    def sample(self, queries, samples, batch_size=8, max_batch_tokens=4096, max_new_tokens=512):
+        # `samples` responses per query, as one list per query
+        prompts = [query for query in queries for _ in range(samples)]
+        responses = self.generate(prompts, batch_size, max_batch_tokens, max_new_tokens)
+        return [responses[i * samples:(i + 1) * samples] for i in range(len(queries))]
+
+    def score(self, query, labels):
+        raise NotImplementedError(f"The {self.name} backend cannot score labels, use mode=\"generate\"")
+
+    def stats(self):
+        return self.counters.stats()
+
+class HFBackend(Backend):
+    # transformers on any device. The model is loaded on first use, so runs
+    # answered from the classifier cache never import torch. One lock per
+    # backend serializes tokenizer and model use: a fast tokenizer shared by
+    # threads raises "Already borrowed", and the pipeline's workers share it.
+    name = "hf"
+
+    def __init__(self, model_path, device="cpu", prefix_cache_bytes=0):
+        super().__init__(model_path)
+        self.device = device
+        self.model, self.tokenizer = lazy_pair(lambda: load_model_and_tokenizer(model_path, device))
+        self.prefix_cache = PrefixKVCache(self.model, max_bytes=prefix_cache_bytes) if prefix_cache_bytes else None
+        self.padding = PaddingStats()
+        self.lock = threading.Lock()
+
+    def build_prompt(self, query):
+        return self.tokenizer.apply_chat_template(
+            chat_messages(query),
+            tokenize=False,
+            add_generation_prompt=True
+        )
+
+    def prefix_lengths(self, text, query):
+        # Token boundaries shared between classifier prompts: the chat template up
+        # to the query, and the query up to the per-level list ("...in the first
+        # list", "...in the second list", ...). A boundary is only usable when
+        # tokenizing the prefix alone reproduces the same leading tokens.
+        query_start = text.find(query)
+        if query_start == -1:
+            return []
+        boundaries = [query_start]
+        fork = query.find(" belong to which entity in the")
+        if fork != -1:
+            boundaries.append(query_start + fork)
+        input_ids = self.tokenizer(text).input_ids
+        lengths = []
+        for boundary in boundaries:
+            ids = self.tokenizer(text[:boundary]).input_ids
+            if ids and input_ids[:len(ids)] == ids:
+                lengths.append(len(ids))
+        return lengths
+
+    def generate_one(self, query, max_new_tokens=512):
+        with self.lock:
+            tokenizer = self.tokenizer
+            text = self.build_prompt(query)
+            model_inputs = tokenizer([text], return_tensors="pt").to(self.device)
+
+            # past_key_values only goes in when a prefix was found: generate
+            # checks for the key, not its value, and fails on None
+            cached = {}
+            if self.prefix_cache is not None:
+                past_key_values, _ = self.prefix_cache.get(model_inputs.input_ids[0].tolist(), self.prefix_lengths(text, query))
+                if past_key_values is not None:
+                    cached["past_key_values"] = past_key_values
+
+            start_time = time.perf_counter()
+            generated_ids = self.model.generate(
+                input_ids=model_inputs.input_ids,
+                max_new_tokens=max_new_tokens,
+                **cached,
+            )
+            generated_ids = generated_ids[:, model_inputs.input_ids.shape[1]:]
+            self.counters.record(1, model_inputs.input_ids.shape[1], generated_ids.shape[1], time.perf_counter() - start_time)
+            return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+
+    def generate(self, queries, batch_size=8, max_batch_tokens=4096, max_new_tokens=512, num_return_sequences=1, do_sample=False):
+        # Greedy unless do_sample. With num_return_sequences > 1 every prompt
+        # is encoded once and sampled that many times; its responses come
+        # back next to each other.
+        with self.lock:
+            tokenizer = self.tokenizer
+            texts = [self.build_prompt(query) for query in queries]
+            lengths = [len(input_ids) for input_ids in tokenizer(texts).input_ids] if texts else []
+            responses = [None] * (len(texts) * num_return_sequences)
+            sampling = dict(do_sample=True, num_return_sequences=num_return_sequences) if do_sample else {}
+
+            # prompts of similar length share a batch; responses go back by index
+            for batch in bucket_batches(lengths, max(1, batch_size // num_return_sequences), max_batch_tokens // num_return_sequences):
+                self.padding.record([lengths[i] for i in batch])
+                model_inputs = tokenizer([texts[i] for i in batch], return_tensors="pt", padding=True).to(self.device)
+                start_time = time.perf_counter()
+                generated_ids = self.model.generate(
+                    input_ids=model_inputs.input_ids,
+                    attention_mask=model_inputs.attention_mask,
+                    pad_token_id=tokenizer.pad_token_id,
+                    max_new_tokens=max_new_tokens,
+                    **sampling,
+                )
+                generated_ids = generated_ids[:, model_inputs.input_ids.shape[1]:]
+                self.counters.record(
+                    len(batch), sum(lengths[i] for i in batch), int((generated_ids != tokenizer.pad_token_id).sum()), time.perf_counter() - start_time
+                )
+                decoded = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+                for position, i in enumerate(batch):
+                    for sample in range(num_return_sequences):
+                        responses[i * num_return_sequences + sample] = decoded[position * num_return_sequences + sample]
+            return responses
+
+    def sample(self, queries, samples, batch_size=8, max_batch_tokens=4096, max_new_tokens=512):
+        responses = self.generate(queries, batch_size, max_batch_tokens, max_new_tokens, num_return_sequences=samples, do_sample=True)
+        return [responses[i * samples:(i + 1) * samples] for i in range(len(queries))]
+
+    def score(self, query, labels):
+        import torch
+
+        with self.lock:
+            # One forward pass over the prompt, then every candidate continuation is
+            # scored against the shared prompt cache in a single batched pass.
+            # Score = summed log-likelihood of the label tokens plus end-of-turn.
+            model = self.model
+            tokenizer = self.tokenizer
+            device = self.device
+            text = self.build_prompt(query)
+            prompt_ids = tokenizer([text], return_tensors="pt").input_ids.to(device)
+            past_key_values = None
+            cached_length = 0
+            if self.prefix_cache is not None:
+                past_key_values, cached_length = self.prefix_cache.get(prompt_ids[0].tolist(), self.prefix_lengths(text, query))
+            start_time = time.perf_counter()
+            with torch.no_grad():
+                outputs = model(input_ids=prompt_ids[:, cached_length:], past_key_values=past_key_values, use_cache=True)
+            first_log_probs = torch.log_softmax(outputs.logits[0, -1].float(), dim=-1)
+            past_key_values = to_legacy(outputs.past_key_values)
+
+            label_ids = []
+            for label in labels:
+                ids = tokenizer(label, add_special_tokens=False).input_ids
+                if tokenizer.eos_token_id is not None:
+                    ids = ids + [tokenizer.eos_token_id]
+                label_ids.append(ids)
+
+            rows = len(labels)
+            width = max(len(ids) for ids in label_ids)
+            pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+            continuation = torch.tensor(
+                [ids + [pad_token_id] * (width - len(ids)) for ids in label_ids], device=device
+            )
+            past_key_values = tuple(
+                (key.expand(rows, -1, -1, -1), value.expand(rows, -1, -1, -1)) for key, value in past_key_values
+            )
+            attention_mask = torch.ones((rows, prompt_ids.shape[1] + width), dtype=torch.long, device=device)
+            with torch.no_grad():
+                logits = model(input_ids=continuation, past_key_values=past_key_values, attention_mask=attention_mask).logits
+            log_probs = torch.log_softmax(logits.float(), dim=-1)
+            self.counters.record(rows, prompt_ids.shape[1] - cached_length + rows * width, 0, time.perf_counter() - start_time, kind="score")
+
+            scores = {}
+            for row, (label, ids) in enumerate(zip(labels, label_ids)):
+                score = first_log_probs[ids[0]].item()
+                for position in range(1, len(ids)):
+                    score += log_probs[row, position - 1, ids[position]].item()
+                scores[label] = score
+            best = max(labels, key=lambda label: scores[label])
+            return best, scores
+
+    def stats(self):
+        stats = super().stats()
+        stats["padding"] = self.padding.stats()
+        if self.prefix_cache is not None:
+            stats["prefix_cache"] = self.prefix_cache.stats()
+        return stats
+
+class LMDeployBackend(Backend):
+    # lmdeploy's TurboMind engine; it schedules and batches the prompts it is
+    # given by itself, so batch_size and max_batch_tokens only cap one call.
+    name = "lmdeploy"
+
+    def __init__(self, model_path, session_len=8192):
+        super().__init__(model_path)
+        self.session_len = session_len
+        self.pipe = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.pipe is None:
+                from lmdeploy import TurbomindEngineConfig, pipeline
+
+                self.pipe = pipeline(self.model_path, backend_config=TurbomindEngineConfig(session_len=self.session_len))
+        return self.pipe
+
+    def generate(self, queries, batch_size=8, max_batch_tokens=4096, max_new_tokens=512, do_sample=False):
+        from lmdeploy import GenerationConfig
+
+        pipe = self.load()
+        # greedy, like model.generate with the default config; do_sample uses
+        # the top_k and temperature model.generate samples with by default
+        if do_sample:
+            gen_config = GenerationConfig(max_new_tokens=max_new_tokens, top_k=50, temperature=1.0)
+        else:
+            gen_config = GenerationConfig(max_new_tokens=max_new_tokens, top_k=1)
+        responses = []
+        for start in range(0, len(queries), batch_size):
+            start_time = time.perf_counter()
+            outputs = pipe([chat_messages(query) for query in queries[start:start + batch_size]], gen_config=gen_config)
+            self.counters.record(
+                len(outputs),
+                sum(output.input_token_len for output in outputs),
+                sum(output.generate_token_len for output in outputs),
+                time.perf_counter() - start_time,
+            )
+            responses.extend(output.text for output in outputs)
+        return responses
+
+    def sample(self, queries, samples, batch_size=8, max_batch_tokens=4096, max_new_tokens=512):
+        prompts = [query for query in queries for _ in range(samples)]
+        responses = self.generate(prompts, batch_size, max_batch_tokens, max_new_tokens, do_sample=True)
+        return [responses[i * samples:(i + 1) * samples] for i in range(len(queries))]
+
+def mark_entities(sentence, entities):
+    # The extractor's answer format, marked the way stage1_trans.py builds
+    # the training targets.
+    for entity in sorted(entities, key=len, reverse=True):
+        sentence = sentence.replace(entity, f'##{entity}##')
+    return sentence
+
+CLASSIFIER_QUERY = re.compile(r'^The ##(.*?)## in the sentence: "(.*)" belong to which entity in the (\w+) list: (.*)\?$', re.DOTALL)
+JOINT_QUERY = re.compile(r'^The entities (.*?) in the sentence: "(.*)" belong to which entity in the (\w+) list: (.*)\? Answer with one', re.DOTALL)
+
+class FakeBackend(Backend):
+    # Deterministic stand-in that answers from a GEIC file: extractor prompts
+    # (a bare sentence) get the gold entities marked, classifier prompts get
+    # the gold category's ancestor at the asked level (one "entity: label"
+    # line per entity for joint prompts). Anything it does not
+    # know gets a stable hash-picked answer. `latency` seconds per call plus
+    # `prompt_latency` per prompt simulate model time without any weights;
+    # `drop_rate` mimics sampling noise: each gold entity is left out of an
+    # extractor answer with a probability between 0 and 2 * drop_rate that
+    # is fixed per entity, so some entities are hard and most are easy. Each
+    # draw hashes the query, the entity and how many answers the query has
+    # had, so a run is repeatable whatever order threads ask in.
+    name = "fake"
+
+    def __init__(self, gold_path, category_file_path, latency=0.0, prompt_latency=0.0, drop_rate=0.0):
+        super().__init__(f"fake:{gold_path}")
+        self.latency = latency
+        self.prompt_latency = prompt_latency
+        self.drop_rate = drop_rate
+        self.answers = Counter()
+        self.lock = threading.Lock()
+        self.entities = {}
+        hierarchy = load_category_hierarchy(category_file_path)
+        self.ordinals = hierarchy.ordinals
+        self.marked = {}
+        self.paths = {}
+        with open(gold_path, 'r', encoding='utf-8') as f:
+            records = json.load(f).values()
+        for record in records:
+            self.marked[record["sentence"]] = mark_entities(record["sentence"], record["entity"])
+            self.entities[record["sentence"]] = record["entity"]
+            for entity, category in zip(record["entity"], record["category"]):
+                path = hierarchy.find_path(category)
+                self.paths[(entity, record["sentence"])] = path
+                self.paths.setdefault((entity.lower(), record["sentence"]), path)
+
+    def difficulty(self, entity):
+        return 2 * int(hashlib.blake2b(entity.encode("utf-8"), digest_size=8).hexdigest(), 16) / (1 << 64)
+
+    def draw(self, *key):
+        return int(hashlib.blake2b("\0".join(key).encode("utf-8"), digest_size=8).hexdigest(), 16) / (1 << 64)
+
+    def label(self, entity, sentence, ordinal, label_list, seed):
+        labels = label_list.split(", ")
+        path = self.paths.get((entity, sentence))
+        depth = self.ordinals.index(ordinal) if ordinal in self.ordinals else -1
+        if path is not None and 0 <= depth < len(path) and path[depth].lower() in labels:
+            return path[depth].lower()
+        return labels[int(hashlib.blake2b(seed.encode("utf-8"), digest_size=8).hexdigest(), 16) % len(labels)]
+
+    def answer(self, query):
+        match = JOINT_QUERY.match(query)
+        if match is not None:
+            entities, sentence, ordinal, label_list = match.groups()
+            return "\n".join(
+                f"{entity}: {self.label(entity, sentence, ordinal, label_list, query + entity)}"
+                for entity in re.findall(r'##(.*?)##', entities)
+            )
+        match = CLASSIFIER_QUERY.match(query)
+        if match is None:
+            if self.drop_rate and query in self.entities:
+                with self.lock:
+                    sample = str(self.answers[query])
+                    self.answers[query] += 1
+                return mark_entities(query, [
+                    entity for entity in self.entities[query]
+                    if self.draw(query, entity, sample) >= self.difficulty(entity) * self.drop_rate
+                ])
+            return self.marked.get(query, query)
+        entity, sentence, ordinal, label_list = match.groups()
+        return self.label(entity, sentence, ordinal, label_list, query)
+
+    def generate(self, queries, batch_size=8, max_batch_tokens=4096, max_new_tokens=512):
+        responses = []
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            start_time = time.perf_counter()
+            time.sleep(self.latency + self.prompt_latency * len(batch))
+            answers = [self.answer(query) for query in batch]
+            self.counters.record(
+                len(batch),
+                sum(len(query.split()) for query in batch),
+                sum(len(answer.split()) for answer in answers),
+                time.perf_counter() - start_time,
+            )
+            responses.extend(answers)
+        return responses
+
+    def score(self, query, labels):
+        best = self.generate([query], 1)[0]
+        scores = {label: 0.0 if label == best else -1.0 for label in labels}
+        if best not in scores:
+            best = labels[0]
+            scores[best] = 0.0
+        return best, scores
+
+def make_backend(kind, model_path, device="cpu", prefix_cache_bytes=0, gold_path=None, category_file_path=None, latency=0.0, prompt_latency=0.0, drop_rate=0.0):
+    if kind == "hf":
+        return HFBackend(model_path, device, prefix_cache_bytes)
+    if kind == "lmdeploy":
+        return LMDeployBackend(model_path)
+    if kind == "fake":
+        return FakeBackend(gold_path, category_file_path, latency, prompt_latency, drop_rate)
+    raise ValueError(f"Unknown backend: {kind} (expected one of {', '.join(BACKENDS)})")
@@ -0,0 +1,111 @@
+import threading
+import time
+
+def make_batches(lengths, batch_size, max_batch_tokens):
+    # Greedy packing in input order; a batch costs rows * longest row once padded.
+    batch = []
+    width = 0
+    for index, length in enumerate(lengths):
+        new_width = max(width, length)
+        if batch and (len(batch) >= batch_size or new_width * (len(batch) + 1) > max_batch_tokens):
+            yield batch
+            batch = []
+            new_width = length
+        batch.append(index)
+        width = new_width
+    if batch:
+        yield batch
+
+class PaddingStats:
+    # Padding efficiency: real prompt tokens over the tokens actually run once
+    # every row is padded to the longest one in its batch.
+    def __init__(self):
+        self.batches = 0
+        self.rows = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, lengths):
+        with self.lock:
+            self.batches += 1
+            self.rows += len(lengths)
+            self.tokens += sum(lengths)
+            self.padded_tokens += len(lengths) * max(lengths, default=0)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "tokens": self.tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_efficiency": self.tokens / self.padded_tokens if self.padded_tokens else 1.0,
+        }
+
+class LengthBucketScheduler:
+    # Collects pending prompts into buckets of similar tokenized length and
+    # hands out batches of at most batch_size rows and max_batch_tokens padded
+    # tokens. A bucket is released as soon as it fills up, once its oldest
+    # prompt has waited max_wait seconds (see due), or on flush.
+    def __init__(self, batch_size=8, max_batch_tokens=4096, bucket_width=32, max_wait=0.05):
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.bucket_width = bucket_width
+        self.max_wait = max_wait
+        self.buckets = {}
+
+    def __len__(self):
+        return sum(len(bucket["items"]) for bucket in self.buckets.values())
+
+    def add(self, item, length, now=None):
+        # Returns the batches (lists of items) completed by this prompt.
+        now = time.monotonic() if now is None else now
+        key = length // self.bucket_width
+        bucket = self.buckets.setdefault(key, {"since": now, "items": [], "lengths": []})
+        ready = []
+        width = max(max(bucket["lengths"], default=0), length)
+        if bucket["items"] and width * (len(bucket["items"]) + 1) > self.max_batch_tokens:
+            ready.append([item for item, _ in self.release(key)])
+            bucket = self.buckets.setdefault(key, {"since": now, "items": [], "lengths": []})
+        bucket["items"].append(item)
+        bucket["lengths"].append(length)
+        if len(bucket["items"]) >= self.batch_size:
+            ready.append([item for item, _ in self.release(key)])
+        return ready
+
+    def release(self, key):
+        bucket = self.buckets.pop(key)
+        return list(zip(bucket["items"], bucket["lengths"]))
+
+    def due(self, now=None):
+        # Batches of every bucket whose oldest prompt has hit the deadline.
+        now = time.monotonic() if now is None else now
+        expired = [key for key, bucket in self.buckets.items() if now - bucket["since"] >= self.max_wait]
+        return self.pack([entry for key in sorted(expired) for entry in self.release(key)])
+
+    def next_deadline(self):
+        if not self.buckets:
+            return None
+        return min(bucket["since"] for bucket in self.buckets.values()) + self.max_wait
+
+    def flush(self):
+        # Leftovers of neighbouring buckets may share a batch.
+        return self.pack([entry for key in sorted(self.buckets) for entry in self.release(key)])
+
+    def pack(self, entries):
+        entries.sort(key=lambda entry: entry[1])
+        lengths = [length for _, length in entries]
+        return [
+            [entries[i][0] for i in batch]
+            for batch in make_batches(lengths, self.batch_size, self.max_batch_tokens)
+        ]
+
+def bucket_batches(lengths, batch_size=8, max_batch_tokens=4096, bucket_width=32):
+    # Offline use of the scheduler: every prompt is pending up front, so the
+    # batches are the full buckets followed by the length-sorted leftovers.
+    scheduler = LengthBucketScheduler(batch_size, max_batch_tokens, bucket_width)
+    batches = []
+    for index, length in enumerate(lengths):
+        batches.extend(scheduler.add(index, length))
+    batches.extend(scheduler.flush())
+    return batches
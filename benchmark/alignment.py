@@ -0,0 +1,83 @@
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from spans import align_response
+
+def legacy_extract_entities_with_positions(sentence, response):
+    # extract_entities_with_positions as it was before spans.align_response
+    entities = []
+    for match in re.finditer(r"##(.*?)##", response):
+        entity_text = match.group(1)
+        start_idx = sentence.find(entity_text)
+        if start_idx != -1:
+            end_idx = start_idx + len(entity_text)
+            entities.append({"text": entity_text, "start": start_idx, "end": end_idx})
+        else:
+            for m in re.finditer(re.escape(entity_text), sentence):
+                entities.append({"text": entity_text, "start": m.start(), "end": m.end()})
+                break
+    return entities
+
+def build_case(records, sentences_per_case, noise):
+    # A long "sentence" made of several corpus sentences; entities repeat
+    # whenever the same sentence is drawn twice. With `noise`, the response
+    # drops a space now and then, as small extractors tend to do.
+    chosen = [random.choice(records) for _ in range(sentences_per_case)]
+    sentence = ""
+    response = ""
+    gold = []
+    for record in chosen:
+        text = record["sentence"]
+        spans = []
+        for entity in sorted(set(record["entity"]), key=len, reverse=True):
+            for match in re.finditer(re.escape(entity), text):
+                if all(match.end() <= s or match.start() >= e for s, e in spans):
+                    spans.append((match.start(), match.end()))
+        spans.sort()
+        offset = len(sentence)
+        marked = ""
+        position = 0
+        for start, end in spans:
+            marked += text[position:start] + f"##{text[start:end]}##"
+            gold.append((offset + start, offset + end))
+            position = end
+        marked += text[position:]
+        if noise and random.random() < noise:
+            marked = marked.replace(" , ", ", ", 1)
+        sentence += text + " "
+        response += marked + " "
+    return sentence, response, gold
+
+def score(function, cases):
+    found = 0
+    total = 0
+    start_time = time.perf_counter()
+    predictions = [function(sentence, response) for sentence, response, _ in cases]
+    elapsed = time.perf_counter() - start_time
+    for (_, _, gold), entities in zip(cases, predictions):
+        total += len(gold)
+        found += len(set(gold) & {(entity["start"], entity["end"]) for entity in entities})
+    return {"seconds": elapsed, "span_recall": found / total if total else 0.0}
+
+def main(corpus_path, cases, sentences_per_case, noise, seed):
+    random.seed(seed)
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        records = list(json.load(f).values())
+    data = [build_case(records, sentences_per_case, noise) for _ in range(cases)]
+    report = {
+        "cases": cases,
+        "sentences_per_case": sentences_per_case,
+        "noise": noise,
+        "legacy": score(legacy_extract_entities_with_positions, data),
+        "align_response": score(align_response, data),
+    }
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    corpus_path = "./DynamicNER/example.json"
+    main(corpus_path, cases=200, sentences_per_case=40, noise=0.3, seed=0)
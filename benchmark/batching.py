@@ -0,0 +1,54 @@
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from batching import PaddingStats, bucket_batches, make_batches
+from category_hierarchy import load_category_hierarchy
+from infer import build_query
+
+def classifier_prompts(records, hierarchy):
+    # The queries categorize_entities sends for the gold entities: the
+    # first-level list, then the list below the gold first-level category.
+    prompts = []
+    for record in records:
+        sentence = record["sentence"]
+        for entity, category in zip(record["entity"], record["category"]):
+            path = hierarchy.find_path(category)
+            parent = None
+            for depth, ordinal in enumerate(hierarchy.ordinals):
+                label_list = hierarchy.prompt(depth, parent)
+                if label_list is None:
+                    break
+                prompts.append(build_query(entity if depth == 0 else entity.lower(), sentence, ordinal, label_list))
+                parent = path[depth]
+    return prompts
+
+def padding(batcher, lengths, batch_size, max_batch_tokens):
+    stats = PaddingStats()
+    for batch in batcher(lengths, batch_size, max_batch_tokens):
+        stats.record([lengths[i] for i in batch])
+    return stats.stats()
+
+def main(corpus_path, category_file_path, batch_size, max_batch_tokens, seed):
+    random.seed(seed)
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        records = list(json.load(f).values())
+    prompts = classifier_prompts(records, load_category_hierarchy(category_file_path))
+    random.shuffle(prompts)
+    # about four characters per token; the ratio matters, not the tokenizer
+    lengths = [len(prompt) // 4 + 1 for prompt in prompts]
+    report = {
+        "prompts": len(prompts),
+        "batch_size": batch_size,
+        "max_batch_tokens": max_batch_tokens,
+        "input_order": padding(make_batches, lengths, batch_size, max_batch_tokens),
+        "length_buckets": padding(bucket_batches, lengths, batch_size, max_batch_tokens),
+    }
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    corpus_path = "./DynamicNER/example.json"
+    category_file_path = "./DynamicNER/DynamicNER.json"
+    main(corpus_path, category_file_path, batch_size=8, max_batch_tokens=4096, seed=0)
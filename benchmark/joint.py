@@ -0,0 +1,53 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from backends import make_backend
+from category_hierarchy import load_category_hierarchy
+from infer import categorize_entities_batch
+from telemetry import metrics
+
+def run(records, hierarchy, backend, model_path, corpus_path, category_file_path, device, joint, batch_size, max_batch_tokens):
+    # Categorizes the gold entities of every sentence, so both runs answer
+    # exactly the same questions.
+    classifier = make_backend(backend, model_path, device, gold_path=corpus_path, category_file_path=category_file_path)
+    items = [(record["entity"], record["sentence"]) for record in records if record["entity"]]
+    categories = categorize_entities_batch(items, classifier, hierarchy, batch_size, max_batch_tokens, joint=joint)
+    return categories, classifier.stats()
+
+def main(corpus_path, category_file_path, backend, model_path, device, batch_size, max_batch_tokens):
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        records = list(json.load(f).values())
+    hierarchy = load_category_hierarchy(category_file_path)
+    options = dict(batch_size=batch_size, max_batch_tokens=max_batch_tokens)
+    per_entity, per_entity_stats = run(records, hierarchy, backend, model_path, corpus_path, category_file_path, device, False, **options)
+    joint, joint_stats = run(records, hierarchy, backend, model_path, corpus_path, category_file_path, device, True, **options)
+
+    entities = sum(len(labels) for labels in per_entity)
+    agree = sum(a == b for left, right in zip(per_entity, joint) for a, b in zip(left, right))
+    fallback = {sample["labels"]["result"]: sample["value"] for sample in metrics.snapshot()["counters"].get("joint_entities_total", [])}
+    report = {
+        "sentences": len(per_entity),
+        "entities": entities,
+        "per_entity": per_entity_stats,
+        "joint": joint_stats,
+        "joint_entities": fallback,
+        "prompt_savings": 1 - joint_stats["prompts"] / per_entity_stats["prompts"] if per_entity_stats["prompts"] else 0.0,
+        "prompt_token_savings": 1 - joint_stats["prompt_tokens"] / per_entity_stats["prompt_tokens"] if per_entity_stats["prompt_tokens"] else 0.0,
+        "label_agreement": agree / entities if entities else 0.0,
+    }
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main(
+        "./DynamicNER/example.json",
+        "./DynamicNER/DynamicNER.json",
+        # "fake" answers from the gold labels and counts words as tokens; use
+        # "hf" with a classifier model path for real token counts
+        backend="fake",
+        model_path="./model/classifier/zeroshot/1b-sft",
+        device="cpu",
+        batch_size=8,
+        max_batch_tokens=4096,
+    )
@@ -0,0 +1,103 @@
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from infer import default_settings, run_inference, run_sharded
+
+def count_sentences(stream_file):
+    with open(stream_file, "r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+def write_dataset(corpus_path, dataset_path):
+    # the sentences of a GEIC file as the JSONL dataset of the in-process extractor
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        sentences = [record["sentence"] for record in json.load(f).values()]
+    with open(dataset_path, "w", encoding="utf-8") as f:
+        for sentence in sentences:
+            f.write(json.dumps({"query": sentence}, ensure_ascii=False) + "\n")
+
+def time_run(settings, workers):
+    # Every run classifies from scratch: no checkpoint, no decision cache.
+    start_time = time.perf_counter()
+    if workers == 1:
+        run_inference(settings)
+    else:
+        run_sharded(settings, workers)
+    elapsed = time.perf_counter() - start_time
+    sentences = count_sentences(settings["stream_file"])
+    return {"workers": workers, "seconds": elapsed, "sentences": sentences, "sentences_per_second": sentences / elapsed}
+
+def main(results_dir, worker_counts, backend, extractor, infer_result_dir, corpus_path, extractor_model, classifier_model,
+         category_file_path, device, latency, limit, window):
+    work_dir = tempfile.mkdtemp()
+    try:
+        settings = default_settings()
+        settings.update(
+            backend=backend,
+            extractor=extractor,
+            infer_result_dir=infer_result_dir,
+            fake_gold_path=corpus_path,
+            fake_latency=latency,
+            local_model_path1=extractor_model,
+            local_model_path2=classifier_model,
+            category_file_path=category_file_path,
+            device=device,
+            limit=limit,
+            window=window,
+            cache_path=None,
+            resume=False,
+            output_file=None,
+            stream_file=os.path.join(work_dir, "output.jsonl"),
+            checkpoint_file=os.path.join(work_dir, "output.ckpt"),
+        )
+        if extractor == "inprocess":
+            settings["dataset_path"] = os.path.join(work_dir, "dataset.jsonl")
+            write_dataset(corpus_path, settings["dataset_path"])
+        runs = [time_run(settings, workers) for workers in worker_counts]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = runs[0]["sentences_per_second"]
+    for run in runs:
+        run["speedup"] = run["sentences_per_second"] / baseline
+        run["efficiency"] = run["speedup"] / run["workers"] * worker_counts[0]
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "options": {"backend": backend, "extractor": extractor, "device": device, "latency": latency, "limit": limit, "window": window},
+        "runs": runs,
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    result_path = os.path.join(results_dir, f"scaling-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
+    print(f"Written to {result_path}")
+
+if __name__ == "__main__":
+    main(
+        "./benchmark/results",
+        [1, 2, 4, 8],
+        # "fake" needs no weights; use "hf" or "lmdeploy" with real model paths
+        backend="fake",
+        # "swift" reads the responses in infer_result_dir; "inprocess" extracts
+        # the sentences of corpus_path (the fake's gold file) in every worker
+        extractor="inprocess",
+        infer_result_dir="./model/stage1/zeroshot/1b-sft/infer_result/",
+        corpus_path="./DynamicNER/example.json",
+        extractor_model="./model/extractor/zeroshot/1b-sft",
+        classifier_model="./model/classifier/zeroshot/1b-sft",
+        category_file_path="./DynamicNER/DynamicNER.json",
+        device="cpu",
+        # seconds per fake model call, standing in for model time
+        latency=0.002,
+        limit=-1,
+        window=8,
+    )
@@ -0,0 +1,166 @@
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from backends import make_backend
+from category_hierarchy import LEVELS, load_category_hierarchy
+from infer import extract_responses, iter_windows, label_window
+
+FILLER = (
+    "the of and to in a is that for it as was with be by on not he this are or his from at which but "
+    "have an they you were their one all we can her has there been if more when will would who so no"
+).split()
+SURNAMES = ("Smith", "Garcia", "Tanaka", "Müller", "Rossi", "Kowalski", "Dubois", "Silva", "Ivanov", "Okafor")
+
+def build_categories(depth, branching):
+    # A category file with `depth` levels (1-3) and `branching` children per
+    # node; labels are lowercase so they read like DynamicNER's.
+    names = [f"type {i}" for i in range(branching)]
+    categories = {"dataset": "synthetic", "first-level": ", ".join(names)}
+    for level in LEVELS[1:depth]:
+        categories[level] = {}
+        children = []
+        for parent in names:
+            labels = [f"{parent}.{j}" for j in range(branching)]
+            categories[level][parent] = ", ".join(labels)
+            children.extend(labels)
+        names = children
+    return categories, names
+
+def build_corpus(sentences, sentence_length, entity_density, leaves, seed):
+    # GEIC records shaped like DynamicNER/example.json. entity_density is the
+    # expected number of entities per filler word; every entity is a unique
+    # two-word name so the gold spans are unambiguous.
+    rng = random.Random(seed)
+    corpus = {}
+    serial = 0
+    for index in range(sentences):
+        words = [rng.choice(FILLER) for _ in range(sentence_length)]
+        count = sum(1 for _ in range(sentence_length) if rng.random() < entity_density)
+        entities = []
+        categories = []
+        for position in sorted(rng.sample(range(sentence_length + 1), min(count, sentence_length + 1)), reverse=True):
+            serial += 1
+            entity = f"Name{serial} {rng.choice(SURNAMES)}"
+            words.insert(position, entity)
+            entities.insert(0, entity)
+            categories.insert(0, rng.choice(leaves))
+        corpus[f"sentence{index + 1}"] = {"sentence": " ".join(words) + " .", "entity": entities, "category": categories}
+    return corpus
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024
+
+def run(corpus_path, category_file_path, backend, extractor_model, classifier_model, device, latency, drop_rate, repeat, initial_samples, min_agreement, window, batch_size, max_batch_tokens, mode):
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        queries = [record["sentence"] for record in json.load(f).values()]
+    hierarchy = load_category_hierarchy(category_file_path)
+    options = dict(gold_path=corpus_path, category_file_path=category_file_path, latency=latency)
+    backend1 = make_backend(backend, extractor_model, device, drop_rate=drop_rate, **options)
+    backend2 = make_backend(backend, classifier_model, device, **options)
+
+    kept = 0
+    entities = 0
+    start_time = time.perf_counter()
+    records = extract_responses(backend1, queries, repeat, max(window, batch_size), batch_size, max_batch_tokens,
+                                initial_samples=initial_samples, min_agreement=min_agreement)
+    samples = 0
+    for chunk in iter_windows(records, window):
+        samples += sum(len(responses) for _, responses in chunk)
+        for _, entities_text, categories in label_window(chunk, backend2, hierarchy, batch_size, max_batch_tokens, mode):
+            if categories:
+                kept += 1
+                entities += len(entities_text)
+    elapsed = time.perf_counter() - start_time
+
+    extract_stats = backend1.stats()
+    classify_stats = backend2.stats()
+    calls = extract_stats["calls"] + classify_stats["calls"]
+    return {
+        "sentences": len(queries),
+        "labelled_sentences": kept,
+        "entities": entities,
+        "seconds": elapsed,
+        "sentences_per_second": len(queries) / elapsed if elapsed else 0.0,
+        "extractor_samples_per_sentence": samples / len(queries) if queries else 0.0,
+        "model_calls": calls,
+        "model_calls_per_sentence": calls / len(queries) if queries else 0.0,
+        "prompts_per_sentence": (extract_stats["prompts"] + classify_stats["prompts"]) / len(queries) if queries else 0.0,
+        "prompt_tokens": extract_stats["prompt_tokens"] + classify_stats["prompt_tokens"],
+        "generated_tokens": extract_stats["generated_tokens"] + classify_stats["generated_tokens"],
+        "extract": extract_stats,
+        "classify": classify_stats,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def main(results_dir, sentences, sentence_length, entity_density, depth, branching, seed, **run_options):
+    work_dir = tempfile.mkdtemp()
+    try:
+        categories, leaves = build_categories(depth, branching)
+        category_file_path = os.path.join(work_dir, "categories.json")
+        corpus_path = os.path.join(work_dir, "corpus.json")
+        with open(category_file_path, "w", encoding="utf-8") as f:
+            json.dump(categories, f, ensure_ascii=False, indent=4)
+        with open(corpus_path, "w", encoding="utf-8") as f:
+            json.dump(build_corpus(sentences, sentence_length, entity_density, leaves, seed), f, ensure_ascii=False, indent=4)
+
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "corpus": {
+                "sentences": sentences,
+                "sentence_length": sentence_length,
+                "entity_density": entity_density,
+                "depth": depth,
+                "branching": branching,
+                "seed": seed,
+            },
+            "options": run_options,
+            "results": run(corpus_path, category_file_path, **run_options),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(results_dir, exist_ok=True)
+    result_path = os.path.join(results_dir, f"throughput-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
+    print(f"Written to {result_path}")
+
+if __name__ == "__main__":
+    main(
+        "./benchmark/results",
+        sentences=2000,
+        sentence_length=25,
+        entity_density=0.1,
+        depth=3,
+        branching=6,
+        seed=0,
+        # "fake" needs no weights; use "hf" or "lmdeploy" with real model paths
+        backend="fake",
+        extractor_model="./model/extractor/zeroshot/1b-sft",
+        classifier_model="./model/classifier/zeroshot/1b-sft",
+        device="cpu",
+        latency=0.002,
+        # share of gold entities the fake extractor misses per sample
+        drop_rate=0.0,
+        repeat=3,
+        # set min_agreement (e.g. 0.8) to sample beyond initial_samples only where samples disagree
+        initial_samples=2,
+        min_agreement=None,
+        window=8,
+        batch_size=8,
+        max_batch_tokens=4096,
+        mode="generate",
+    )
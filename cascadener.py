@@ -0,0 +1,189 @@
+import import_profile
+import_profile.install_if_requested()
+import argparse
+import json
+import os
+import sys
+import time
+
+from infer import (default_settings, extract_options, extract_responses, iter_windows,
+                   label_window, load_backend, load_classifier, close_classifier)
+from category_hierarchy import load_category_hierarchy
+
+STAGES = ("prepare", "extract", "classify", "evaluate")
+
+def default_config():
+    return {
+        # GEIC file ({"sentence1": {"sentence", "entity", "category"}, ...})
+        "input": "./DynamicNER/example.json",
+        "stages": list(STAGES),
+        # intermediate files are only written for the keys given here:
+        # "stage1" (SWIFT conversations file), "responses" (directory of
+        # extractor JSONL, laid out like swift's infer_result) and
+        # "predictions" (the GEIC output evaluate.py reads)
+        "materialize": {"predictions": "output.json"},
+        # overrides of infer.default_settings()
+        "settings": {},
+        # the per-stage timings and metrics are written here as well, if set
+        "report": None,
+    }
+
+def load_config(config_path):
+    config = default_config()
+    with open(config_path, 'r', encoding='utf-8') as f:
+        overrides = json.load(f)
+    unknown = set(overrides) - set(config)
+    if unknown:
+        raise ValueError(f"Unknown config keys: {sorted(unknown)}")
+    config.update(overrides)
+
+    settings = default_settings()
+    unknown = set(config["settings"]) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown settings: {sorted(unknown)}")
+    settings.update(config["settings"])
+    config["settings"] = settings
+
+    unknown = [stage for stage in config["stages"] if stage not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stages: {unknown}")
+    return config
+
+def write_json(data, output_file, indent=4):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+
+def prepare(config, state):
+    with open(config["input"], 'r', encoding='utf-8') as f:
+        state["gold"] = json.load(f)
+    limit = config["settings"]["limit"]
+    ids = list(state["gold"])
+    if limit != -1:
+        ids = ids[:limit]
+    # duplicated sentences are extracted and classified once
+    state["ids"] = {}
+    for sentence_id in ids:
+        state["ids"].setdefault(state["gold"][sentence_id]["sentence"], []).append(sentence_id)
+    state["queries"] = list(state["ids"])
+
+    stage1_file = config["materialize"].get("stage1")
+    if stage1_file:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "DynamicNER", "transformation"))
+        from stage1_trans import convert_to_conversation_format, write_json_file
+        write_json_file(convert_to_conversation_format({sentence_id: state["gold"][sentence_id] for sentence_id in ids}), stage1_file)
+
+def extract(config, state):
+    settings = config["settings"]
+    backend1 = load_backend(settings, settings["local_model_path1"])
+    state["records"] = list(extract_responses(
+        backend1, state["queries"], settings["repeat"],
+        max(settings["window"], settings["batch_size"]), settings["batch_size"], settings["max_batch_tokens"],
+        **extract_options(settings),
+    ))
+
+    responses_dir = config["materialize"].get("responses")
+    if responses_dir:
+        os.makedirs(responses_dir, exist_ok=True)
+        with open(os.path.join(responses_dir, "responses.jsonl"), 'w', encoding='utf-8') as f:
+            for query, responses in state["records"]:
+                for response in responses:
+                    f.write(json.dumps({"query": query, "response": response}, ensure_ascii=False) + '\n')
+
+def classify(config, state):
+    settings = config["settings"]
+    backend2, label_options = load_classifier(settings)
+    hierarchy = load_category_hierarchy(settings["category_file_path"])
+    # Predictions keep the ids of the input, so evaluate pairs every gold
+    # sentence with its own prediction; sentences without entities stay in
+    # with empty lists and count against recall.
+    state["predictions"] = {}
+    for records in iter_windows(state["records"], settings["window"]):
+        for sentence, entities_text, categories in label_window(records, backend2, hierarchy, **label_options):
+            for sentence_id in state["ids"][sentence]:
+                state["predictions"][sentence_id] = {
+                    "sentence": sentence,
+                    "entity": entities_text if categories else [],
+                    "category": categories,
+                }
+    close_classifier(backend2, label_options)
+
+    predictions_file = config["materialize"].get("predictions")
+    if predictions_file:
+        write_json(state["predictions"], predictions_file)
+
+def evaluate(config, state):
+    from evaluate import evaluate_records, iter_common_records
+
+    report = evaluate_records(iter_common_records(state["gold"], state["predictions"]))
+    state["metrics"] = {
+        "precision": report["micro"]["precision"],
+        "recall": report["micro"]["recall"],
+        "f1": report["micro"]["f1"],
+        "macro_precision": report["macro"]["precision"],
+        "macro_recall": report["macro"]["recall"],
+        "macro_f1": report["macro"]["f1"],
+        "entity_precision": report["entity"]["precision"],
+        "entity_recall": report["entity"]["recall"],
+        "entity_f1": report["entity"]["f1"],
+    }
+
+def run(config):
+    # Stages hand their records to the next one in memory; a stage whose
+    # input was not produced in this run reads it from the materialized file.
+    stage_functions = {"prepare": prepare, "extract": extract, "classify": classify, "evaluate": evaluate}
+    state = {}
+    timings = {}
+    for stage in STAGES:
+        if stage not in config["stages"]:
+            continue
+        load_missing_inputs(config, state, stage)
+        start_time = time.perf_counter()
+        stage_functions[stage](config, state)
+        timings[stage] = time.perf_counter() - start_time
+        print(f"Stage {stage}: {timings[stage]:.2f}s")
+
+    report = {"sentences": len(state.get("queries", [])), "seconds": timings, "total_seconds": sum(timings.values())}
+    if "metrics" in state:
+        report["metrics"] = state["metrics"]
+    if config["report"]:
+        write_json(report, config["report"])
+    return report
+
+def load_missing_inputs(config, state, stage):
+    if stage != "prepare" and "gold" not in state:
+        prepare(dict(config, materialize={}), state)
+    if stage == "classify" and "records" not in state:
+        from response_stream import iter_grouped_responses
+
+        responses_dir = config["materialize"].get("responses")
+        if not responses_dir:
+            raise ValueError("classify without extract needs materialize.responses")
+        state["records"] = [
+            record for record in iter_grouped_responses(responses_dir, config["settings"]["repeat"])
+            if record[0] in state["ids"]
+        ]
+    if stage == "evaluate" and "predictions" not in state:
+        predictions_file = config["materialize"].get("predictions")
+        if not predictions_file:
+            raise ValueError("evaluate without classify needs materialize.predictions")
+        with open(predictions_file, 'r', encoding='utf-8') as f:
+            state["predictions"] = json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(prog='cascadener', description='Run the CascadeNER pipeline in one process')
+    parser.add_argument('--import-profile', action='store_true', help='Print where startup time went on exit')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='Run the stages listed in a config file')
+    run_parser.add_argument('--config', type=str, required=True, help='JSON config file, see cascadener.json')
+    run_parser.add_argument('--stages', type=str, nargs='+', choices=STAGES, default=None,
+                            help='Run only these stages (default: the stages of the config)')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.stages:
+        config["stages"] = args.stages
+    report = run(config)
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
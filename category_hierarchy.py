@@ -0,0 +1,110 @@
+import json
+import os
+
+from telemetry import metrics
+
+LEVELS = ["first-level", "second-level", "third-level"]
+
+def normalize_label(label):
+    return label.strip().lower()
+
+class CategoryHierarchy:
+    # Compiled view of a category file ({"first-level": "a, b", "second-level":
+    # {"a": "c, d"}, "third-level": {"c": "e, f"}}). Built once per run; the
+    # classifier side works on normalized label ids, the transformation scripts
+    # on the original names.
+    def __init__(self, category_data):
+        self.dataset = category_data.get("dataset")
+        self.levels = []
+        for level in LEVELS:
+            if level not in category_data:
+                break
+            self.levels.append(level)
+        self.ordinals = [level.split("-")[0] for level in self.levels]
+
+        # (depth, parent id) -> children ids / original list / prompt fragment
+        self.children = {}
+        self.lists = {}
+        self.prompts = {}
+        # depth -> {label id: parent id}
+        self.parents = [{} for _ in self.levels]
+        self.names = {}
+
+        first_level = category_data["first-level"]
+        self.add_node(0, None, first_level)
+        for depth, level in enumerate(self.levels[1:], start=1):
+            for parent, label_list in category_data[level].items():
+                self.add_node(depth, normalize_label(parent), label_list)
+
+        self.paths = {}
+        self.sibling_lists = {level: {} for level in self.levels}
+        self.build_name_tables(category_data)
+
+    def add_node(self, depth, parent, label_list):
+        labels = tuple(normalize_label(label) for label in label_list.split(", "))
+        self.children[(depth, parent)] = labels
+        self.lists[(depth, parent)] = label_list
+        self.prompts[(depth, parent)] = label_list.lower()
+        for name, label in zip(label_list.split(", "), labels):
+            self.parents[depth].setdefault(label, parent)
+            self.names.setdefault(label, name)
+
+    def build_name_tables(self, category_data):
+        # Lookups by original name with the precedence stage2_trans.py always
+        # used: a third-level match beats a second-level one, which beats a
+        # first-level one, and the first list in file order wins.
+        second_level = category_data.get("second-level", {})
+        third_level = category_data.get("third-level", {})
+
+        first_of_second = {}
+        for first, second_list in second_level.items():
+            for second in second_list.split(", "):
+                first_of_second.setdefault(second, first)
+                self.sibling_lists["second-level"].setdefault(second, second_list)
+        for second, third_list in third_level.items():
+            for third in third_list.split(", "):
+                if "third-level" in self.sibling_lists:
+                    self.sibling_lists["third-level"].setdefault(third, third_list)
+                if second in first_of_second:
+                    self.paths.setdefault(third, (first_of_second[second], second, third))
+        for second, first in first_of_second.items():
+            self.paths.setdefault(second, (first, second, second))
+        for first in category_data["first-level"].split(", "):
+            self.paths.setdefault(first, (first, first, first))
+        self.second_level_lists = dict(second_level)
+
+    @property
+    def depth(self):
+        return len(self.levels)
+
+    def prompt(self, depth, parent=None):
+        # Rendered list for the classifier prompt, None when `parent` has no
+        # children at this depth.
+        return self.prompts.get((depth, parent))
+
+    def candidates(self, depth, parent=None):
+        return self.children.get((depth, parent), ())
+
+    def parent(self, depth, label):
+        return self.parents[depth].get(label)
+
+    def find_path(self, category):
+        return self.paths.get(category, ("miscellaneous", "miscellaneous", "miscellaneous"))
+
+    def entity_list(self, level, category):
+        if level == "first-level":
+            return self.lists[(0, None)]
+        if category in self.sibling_lists.get(level, {}):
+            return self.sibling_lists[level][category]
+        if level == "second-level":
+            return self.second_level_lists.get(category, "")
+        return ""
+
+_hierarchies = {}
+
+def load_category_hierarchy(category_file_path):
+    key = os.path.abspath(category_file_path)
+    if key not in _hierarchies:
+        with metrics.timer("file_load_seconds", file="category"), open(category_file_path, "r", encoding="utf-8") as f:
+            _hierarchies[key] = CategoryHierarchy(json.load(f, strict=False))
+    return _hierarchies[key]
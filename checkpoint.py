@@ -0,0 +1,60 @@
+import hashlib
+import os
+
+def query_hash(query):
+    return hashlib.blake2b(query.encode("utf-8"), digest_size=8).hexdigest()
+
+class Checkpoint:
+    # Append-only progress log for process_json_input. Each line is
+    # "<output offset> <next sentence number> <query hash> ..." and is written
+    # after the output records it covers have been synced, so resuming means
+    # truncating the output back to the last offset and skipping every hash.
+    # The first line holds the fingerprint of the run's inputs; a log written
+    # for other inputs is discarded and the run starts over.
+    def __init__(self, path, fingerprint=""):
+        self.path = path
+        self.done = set()
+        self.count = 1
+        self.offset = 0
+        header = f"fingerprint {fingerprint}\n"
+        valid_size = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                lines = iter(f)
+                if next(lines, b"").decode("utf-8") == header:
+                    valid_size = len(header.encode("utf-8"))
+                    for line in lines:
+                        # a line without its newline was torn by a crash
+                        if not line.endswith(b"\n"):
+                            break
+                        parts = line.decode("utf-8").split()
+                        self.offset = int(parts[0])
+                        self.count = int(parts[1])
+                        self.done.update(parts[2:])
+                        valid_size += len(line)
+                elif os.path.getsize(path):
+                    print(f"{path} was written for other inputs, starting over")
+            with open(path, "r+b") as f:
+                f.truncate(valid_size)
+        self.file = open(path, "a", encoding="utf-8")
+        if not valid_size:
+            self.file.write(header)
+            self.file.flush()
+
+    def __contains__(self, query):
+        return query_hash(query) in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def commit(self, queries, count, offset):
+        hashes = [query_hash(query) for query in queries]
+        self.file.write(" ".join([str(offset), str(count)] + hashes) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.done.update(hashes)
+        self.count = count
+        self.offset = offset
+
+    def close(self):
+        self.file.close()
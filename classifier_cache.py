@@ -0,0 +1,101 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from telemetry import metrics
+
+def model_fingerprint(model_path):
+    # Weights are too large to hash on every start, so a model directory is
+    # identified by its file names, sizes and modification times.
+    digest = hashlib.sha1()
+    if os.path.isdir(model_path):
+        for root, _, filenames in sorted(os.walk(model_path)):
+            for filename in sorted(filenames):
+                file_path = os.path.join(root, filename)
+                stat = os.stat(file_path)
+                digest.update(f"{os.path.relpath(file_path, model_path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    else:
+        digest.update(os.path.abspath(model_path).encode("utf-8"))
+    return digest.hexdigest()
+
+def file_fingerprint(file_path):
+    with open(file_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class ClassifierCache:
+    # Two tiers of classifier decisions: an in-memory LRU in front of a SQLite
+    # table. Keys hash the model and category file fingerprints together with
+    # the full query (entity, sentence, level and candidate list) and the
+    # classification mode, so a new model or category file never hits stale rows.
+    # Backends other than "hf" get keys of their own, and backend_inputs names
+    # whatever else decides a backend's answers (the gold file of the fake).
+    def __init__(self, db_path, model_path, category_file_path, capacity=100000, backend="hf", backend_inputs=""):
+        fingerprint = f"{model_fingerprint(model_path)}:{file_fingerprint(category_file_path)}"
+        if backend != "hf":
+            fingerprint = f"{backend}:{backend_inputs}:{fingerprint}"
+        self.fingerprint = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+        self.capacity = capacity
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # Sharded runs share the file between processes: WAL lets them read
+        # while one writes, and every put commits at once so no process holds
+        # the write lock between model calls. Commits in WAL mode with
+        # synchronous=NORMAL don't fsync, so this stays cheap.
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS decisions (key TEXT PRIMARY KEY, label TEXT NOT NULL)")
+        self.connection.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def make_key(self, query, mode):
+        return hashlib.sha1(f"{self.fingerprint}\0{mode}\0{query}".encode("utf-8")).hexdigest()
+
+    def remember(self, key, label):
+        self.memory[key] = label
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def get(self, query, mode="generate"):
+        key = self.make_key(query, mode)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                metrics.inc("classifier_cache_lookups_total", result="memory")
+                return self.memory[key]
+            row = self.connection.execute("SELECT label FROM decisions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.inc("classifier_cache_lookups_total", result="miss")
+                return None
+            self.disk_hits += 1
+            metrics.inc("classifier_cache_lookups_total", result="disk")
+            self.remember(key, row[0])
+            return row[0]
+
+    def put(self, query, label, mode="generate"):
+        key = self.make_key(query, mode)
+        with self.lock:
+            self.remember(key, label)
+            self.connection.execute("INSERT OR REPLACE INTO decisions (key, label) VALUES (?, ?)", (key, label))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
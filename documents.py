@@ -0,0 +1,160 @@
+import import_profile
+import_profile.install_if_requested()
+import argparse
+import json
+import os
+import re
+
+from infer import (categorize_entities_batch, close_classifier, default_settings, extract_entities_with_positions,
+                   extract_options, extract_responses, iter_windows, load_backend, load_classifier, merge_entities)
+from category_hierarchy import load_category_hierarchy
+from output_writer import JsonlWriter, finalize_output
+from spans import select_non_overlapping
+from telemetry import metrics
+
+TOKEN_PATTERNS = {
+    # words and single punctuation marks, as BIO_trans.py splits them
+    "words": re.compile(r'\w+|[^\w\s]'),
+    # every character, as BIO_trans_zh.py splits them
+    "chars": re.compile(r'\S'),
+}
+SENTENCE_ENDS = {".", "!", "?", "。", "！", "？"}
+
+def token_offsets(text, tokenizer="words"):
+    return [(match.start(), match.end()) for match in TOKEN_PATTERNS[tokenizer].finditer(text)]
+
+def segment_document(text, max_tokens=256, overlap=32, tokenizer="words"):
+    # (start, end) character ranges of windows of at most max_tokens tokens,
+    # each sharing `overlap` tokens with the next. A window ends after the
+    # last sentence end in its second half when it has one, so most windows
+    # hold whole sentences.
+    if not 0 <= overlap < max_tokens:
+        raise ValueError(f"overlap must be smaller than max_tokens, got {overlap} and {max_tokens}")
+    tokens = token_offsets(text, tokenizer)
+    windows = []
+    first = 0
+    while first < len(tokens):
+        last = min(first + max_tokens, len(tokens))
+        if last < len(tokens):
+            for i in range(last - 1, first + max_tokens // 2, -1):
+                if text[tokens[i][0]:tokens[i][1]] in SENTENCE_ENDS:
+                    last = i + 1
+                    break
+        windows.append((tokens[first][0], tokens[last - 1][1]))
+        if last == len(tokens):
+            break
+        first = max(last - overlap, first + 1)
+    return windows
+
+def stitch_spans(text, windows, window_spans):
+    # window_spans holds the spans of every window in window coordinates.
+    # Returns them in document coordinates without duplicates: of spans that
+    # overlap, the one furthest from a cut edge of its window wins, since a
+    # span at a cut may be truncated and the next window saw it whole.
+    candidates = []
+    for index, ((window_start, window_end), spans) in enumerate(zip(windows, window_spans)):
+        for span in spans:
+            start = window_start + span["start"]
+            end = window_start + span["end"]
+            left = start - window_start if index > 0 else len(text)
+            right = window_end - end if index < len(windows) - 1 else len(text)
+            candidates.append(dict(span, text=text[start:end], start=start, end=end, margin=min(left, right)))
+    metrics.inc("document_spans_total", len(candidates), stage="windows")
+    selected = select_non_overlapping(candidates, lambda span: (-span["margin"], span["start"] - span["end"], span["start"]))
+    metrics.inc("document_spans_total", len(selected), stage="stitched")
+    return [{key: value for key, value in span.items() if key != "margin"} for span in selected]
+
+def label_documents(texts, backend1, backend2, hierarchy, settings, label_options):
+    # Both stages for a group of documents: the windows of all of them are
+    # extracted and classified in the same batches, then stitched back into
+    # one list of {"text", "start", "end", "support", "category"} per document.
+    windows = [
+        segment_document(text, settings["document_max_tokens"], settings["document_overlap"], settings["document_tokenizer"])
+        for text in texts
+    ]
+    queries = [text[start:end] for text, ranges in zip(texts, windows) for start, end in ranges]
+    metrics.inc("document_windows_total", len(queries))
+    records = extract_responses(
+        backend1, queries, settings["repeat"], max(len(queries), 1), settings["batch_size"], settings["max_batch_tokens"],
+        **extract_options(settings),
+    )
+    window_spans = [
+        merge_entities([extract_entities_with_positions(query, response) for response in responses], label_options["merge_policy"], label_options["min_support"])
+        for query, responses in records
+    ]
+
+    items = [([span["text"] for span in spans], query) for query, spans in zip(queries, window_spans) if spans]
+    categories = iter(categorize_entities_batch(
+        items, backend2, hierarchy, label_options["batch_size"], label_options["max_batch_tokens"], label_options["mode"],
+        label_options["cache"], label_options["max_depth"], label_options["joint"],
+    ))
+    for spans in window_spans:
+        if spans:
+            for span, category in zip(spans, next(categories)):
+                span["category"] = category
+
+    # spans the classifier answered outside its list are left out
+    window_spans = [[span for span in spans if span.get("category") is not None] for spans in window_spans]
+    labelled = []
+    position = 0
+    for text, ranges in zip(texts, windows):
+        labelled.append(stitch_spans(text, ranges, window_spans[position:position + len(ranges)]))
+        position += len(ranges)
+    return labelled
+
+def iter_documents(input_path):
+    # (id, text) from JSONL lines with a "text" and an optional "id", or from
+    # a GEIC file whose "sentence" fields hold whole documents.
+    with open(input_path, 'r', encoding='utf-8') as f:
+        if input_path.endswith('.jsonl'):
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.get("id", f"document{number}"), record["text"]
+        else:
+            for document_id, record in json.load(f).items():
+                yield document_id, record["sentence"]
+
+def run_documents(settings, input_path, output_file, stream_file):
+    # Writes GEIC records keyed by document id, with the character offsets
+    # of every entity next to its text and category.
+    backend1 = load_backend(settings, settings["local_model_path1"])
+    backend2, label_options = load_classifier(settings)
+    hierarchy = load_category_hierarchy(settings["category_file_path"])
+    with JsonlWriter(stream_file) as writer:
+        for chunk in iter_windows(iter_documents(input_path), settings["window"]):
+            labelled = label_documents([text for _, text in chunk], backend1, backend2, hierarchy, settings, label_options)
+            for (document_id, text), spans in zip(chunk, labelled):
+                writer.write(document_id, {
+                    "sentence": text,
+                    "entity": [span["text"] for span in spans],
+                    "category": [span["category"] for span in spans],
+                    "offsets": [[span["start"], span["end"]] for span in spans],
+                })
+            print(f"Processed {len(chunk)} documents")
+    close_classifier(backend2, label_options)
+    finalize_output(stream_file, output_file)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run both stages over long documents in overlapping windows')
+    parser.add_argument('--input', type=str, required=True, help='JSONL with a "text" per line, or a GEIC file of documents')
+    parser.add_argument('--output', type=str, default='documents.json', help='GEIC output with entity offsets (default: documents.json)')
+    parser.add_argument('--tokenizer', type=str, choices=sorted(TOKEN_PATTERNS), default=None,
+                        help='"words" for whitespace languages, "chars" for zh and ja (default: document_tokenizer of infer.py)')
+    parser.add_argument('--max-tokens', type=int, default=None, help='Tokens per window (default: document_max_tokens of infer.py)')
+    parser.add_argument('--overlap', type=int, default=None, help='Tokens shared by neighbouring windows (default: document_overlap of infer.py)')
+    parser.add_argument('--import-profile', action='store_true', help='Print where startup time went on exit')
+    args = parser.parse_args()
+
+    settings = default_settings()
+    if args.tokenizer:
+        settings["document_tokenizer"] = args.tokenizer
+    if args.max_tokens:
+        settings["document_max_tokens"] = args.max_tokens
+    if args.overlap is not None:
+        settings["document_overlap"] = args.overlap
+    run_documents(settings, args.input, args.output, os.path.splitext(args.output)[0] + ".jsonl")
+    metrics.write(settings["metrics_file"], settings["prometheus_file"])
+
+if __name__ == "__main__":
+    main()
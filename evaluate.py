@@ -1,77 +1,162 @@
+import import_profile
+import_profile.install_if_requested()
 import json
-import warnings
-from sklearn.metrics import precision_score, recall_score, f1_score
-from sklearn.preprocessing import MultiLabelBinarizer
+from collections import Counter
 
-warnings.filterwarnings("ignore")
+from category_hierarchy import load_category_hierarchy
+from output_writer import iter_jsonl_records
 
 def extract_entities(entities):
     return set([entity.lower() for entity in entities])
 
-def calculate_entity_metrics(true_data, pred_data):
-    true_entities = []
-    pred_entities = []
+def extract_entities_with_categories(record):
+    return set((entity.lower(), category.lower()) for entity, category in zip(record['entity'], record['category']))
+
+def precision_recall_f1(true_positives, false_positives, false_negatives):
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0
+    # the form sklearn uses, so scores agree to the last bit
+    f1 = 2 * true_positives / (2 * true_positives + false_positives + false_negatives) if true_positives else 0.0
+    return precision, recall, f1
+
+class LabelCounts:
+    # Set-intersection counts per label over a stream of (gold set, predicted
+    # set) pairs, one pair per sentence. Memory grows with the distinct
+    # labels, not with sentences x labels. Scores match the micro average
+    # of MultiLabelBinarizer fit on the gold sets: a predicted label that
+    # never occurs in the gold data is ignored there, and here too unless
+    # strict is set.
+    def __init__(self):
+        self.true_positives = Counter()
+        self.false_negatives = Counter()
+        self.predicted_only = Counter()
+        self.gold = set()
+
+    def add(self, true_labels, pred_labels):
+        self.gold |= true_labels
+        self.true_positives.update(true_labels & pred_labels)
+        self.false_negatives.update(true_labels - pred_labels)
+        self.predicted_only.update(pred_labels - true_labels)
+
+    def counts(self, group=None, strict=False):
+        # {group: [tp, fp, fn]} with group(label) picking the bucket of a
+        # label; one bucket (None) when group is None.
+        totals = {}
+        for index, counter in enumerate((self.true_positives, self.predicted_only, self.false_negatives)):
+            for label, count in counter.items():
+                if index == 1 and not strict and label not in self.gold:
+                    continue
+                key = group(label) if group is not None else None
+                totals.setdefault(key, [0, 0, 0])[index] += count
+        return totals
+
+    def micro(self, strict=False):
+        return precision_recall_f1(*self.counts(strict=strict).get(None, [0, 0, 0]))
 
-    common_sentences = set(true_data.keys()).intersection(set(pred_data.keys()))
-    
-    for sentence in common_sentences:
-        true_entities.append(extract_entities(true_data[sentence]['entity']))
-        pred_entities.append(extract_entities(pred_data[sentence]['entity']))
+    def breakdown(self, group, strict=False):
+        # per group scores, plus their unweighted (macro) mean
+        report = {}
+        for key, counts in sorted(self.counts(group, strict).items()):
+            precision, recall, f1 = precision_recall_f1(*counts)
+            report[key] = {"precision": precision, "recall": recall, "f1": f1, "support": counts[0] + counts[2]}
+        scores = list(report.values())
+        macro = tuple(sum(score[name] for score in scores) / len(scores) if scores else 0.0 for name in ("precision", "recall", "f1"))
+        return report, macro
 
-    mlb = MultiLabelBinarizer()
-    y_true = mlb.fit_transform(true_entities)
-    y_pred = mlb.transform(pred_entities)
+def level_label(hierarchy, depth, category):
+    # ancestor of `category` at `depth`, with the lookup rules of stage2_trans.py
+    name = hierarchy.names.get(category, category)
+    return hierarchy.find_path(name)[depth].lower()
 
-    precision_entity = precision_score(y_true, y_pred, average='micro')
-    recall_entity = recall_score(y_true, y_pred, average='micro')
-    f1_entity = f1_score(y_true, y_pred, average='micro')
-    
-    return precision_entity, recall_entity, f1_entity
+def iter_common_records(true_data, predictions):
+    # (gold record, predicted record) for every sentence id in both;
+    # predictions may be any iterable of records with an "id", e.g. the
+    # stream_file of infer.py, so they are never loaded as a whole.
+    if isinstance(predictions, dict):
+        predictions = ({"id": key, **record} for key, record in predictions.items())
+    for record in predictions:
+        if record["id"] in true_data:
+            yield true_data[record["id"]], record
+
+def evaluate_records(pairs, hierarchy=None, strict=False):
+    # One pass over (gold, predicted) records. Returns micro and macro
+    # precision/recall/F1 for entity + category and for entities alone, the
+    # per-category breakdown and, with a hierarchy, scores at every level.
+    entity_counts = LabelCounts()
+    category_counts = LabelCounts()
+    level_counts = [LabelCounts() for _ in (hierarchy.levels if hierarchy is not None else [])]
+    sentences = 0
+    for true_record, pred_record in pairs:
+        sentences += 1
+        entity_counts.add(extract_entities(true_record['entity']), extract_entities(pred_record['entity']))
+        true_labels = extract_entities_with_categories(true_record)
+        pred_labels = extract_entities_with_categories(pred_record)
+        category_counts.add(true_labels, pred_labels)
+        for depth, counts in enumerate(level_counts):
+            counts.add(
+                set((entity, level_label(hierarchy, depth, category)) for entity, category in true_labels),
+                set((entity, level_label(hierarchy, depth, category)) for entity, category in pred_labels),
+            )
+
+    per_category, macro = category_counts.breakdown(lambda label: label[1], strict)
+    report = {
+        "sentences": sentences,
+        "micro": dict(zip(("precision", "recall", "f1"), category_counts.micro(strict))),
+        "macro": dict(zip(("precision", "recall", "f1"), macro)),
+        "entity": dict(zip(("precision", "recall", "f1"), entity_counts.micro(strict))),
+        "per_category": per_category,
+    }
+    if hierarchy is not None:
+        report["per_level"] = {}
+        for level, counts in zip(hierarchy.levels, level_counts):
+            _, level_macro = counts.breakdown(lambda label: label[1], strict)
+            report["per_level"][level] = {
+                "micro": dict(zip(("precision", "recall", "f1"), counts.micro(strict))),
+                "macro": dict(zip(("precision", "recall", "f1"), level_macro)),
+            }
+    return report
+
+def calculate_entity_metrics(true_data, pred_data):
+    counts = LabelCounts()
+    for true_record, pred_record in iter_common_records(true_data, pred_data):
+        counts.add(extract_entities(true_record['entity']), extract_entities(pred_record['entity']))
+    return counts.micro()
 
 def calculate_metrics(true_data, pred_data):
-    true_entities_with_categories = []
-    pred_entities_with_categories = []
-    
-    common_sentences = set(true_data.keys()).intersection(set(pred_data.keys()))
-    
-    for sentence in common_sentences:
-        true_entities_with_categories.append(
-            set((entity.lower(), category.lower()) for entity, category in zip(true_data[sentence]['entity'], true_data[sentence]['category']))
-        )
-        pred_entities_with_categories.append(
-            set((entity.lower(), category.lower()) for entity, category in zip(pred_data[sentence]['entity'], pred_data[sentence]['category']))
-        )
-
-    mlb = MultiLabelBinarizer()
-    y_true = mlb.fit_transform(true_entities_with_categories)
-    y_pred = mlb.transform(pred_entities_with_categories)
-
-    precision = precision_score(y_true, y_pred, average='micro')
-    recall = recall_score(y_true, y_pred, average='micro')
-    f1 = f1_score(y_true, y_pred, average='micro')
-    
-    return precision, recall, f1
+    counts = LabelCounts()
+    for true_record, pred_record in iter_common_records(true_data, pred_data):
+        counts.add(extract_entities_with_categories(true_record), extract_entities_with_categories(pred_record))
+    return counts.micro()
 
 def load_json(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         return json.load(file)
 
-def main(ground_truth_path, predict_path):
+def main(ground_truth_path, predict_path, category_file_path=None):
+    # predict_path may be the output.json of infer.py or its JSONL stream_file
     ground_truth = load_json(ground_truth_path)
-    predict = load_json(predict_path)
-
-    precision, recall, f1 = calculate_metrics(ground_truth, predict)
-    precision_entity, recall_entity, f1_entity = calculate_entity_metrics(ground_truth, predict)
+    predict = iter_jsonl_records(predict_path) if predict_path.endswith('.jsonl') else load_json(predict_path)
+    hierarchy = load_category_hierarchy(category_file_path) if category_file_path else None
+    report = evaluate_records(iter_common_records(ground_truth, predict), hierarchy)
 
-    print(f"Overall Precision (Entity + Category): {precision:.4f}")
-    print(f"Overall Recall (Entity + Category): {recall:.4f}")
-    print(f"Overall F1 Score (Entity + Category): {f1:.4f}")
-    print(f"Entity-level Precision: {precision_entity:.4f}")
-    print(f"Entity-level Recall: {recall_entity:.4f}")
-    print(f"Entity-level F1 Score: {f1_entity:.4f}")
+    print(f"Overall Precision (Entity + Category): {report['micro']['precision']:.4f}")
+    print(f"Overall Recall (Entity + Category): {report['micro']['recall']:.4f}")
+    print(f"Overall F1 Score (Entity + Category): {report['micro']['f1']:.4f}")
+    print(f"Macro Precision (over categories): {report['macro']['precision']:.4f}")
+    print(f"Macro Recall (over categories): {report['macro']['recall']:.4f}")
+    print(f"Macro F1 Score (over categories): {report['macro']['f1']:.4f}")
+    print(f"Entity-level Precision: {report['entity']['precision']:.4f}")
+    print(f"Entity-level Recall: {report['entity']['recall']:.4f}")
+    print(f"Entity-level F1 Score: {report['entity']['f1']:.4f}")
+    for level, scores in report.get("per_level", {}).items():
+        print(f"{level} micro P/R/F1: {scores['micro']['precision']:.4f} / {scores['micro']['recall']:.4f} / {scores['micro']['f1']:.4f}")
+    print(f"{'Category':<40} {'P':>7} {'R':>7} {'F1':>7} {'Support':>8}")
+    for category, scores in report["per_category"].items():
+        print(f"{category:<40} {scores['precision']:>7.4f} {scores['recall']:>7.4f} {scores['f1']:>7.4f} {scores['support']:>8}")
 
 if __name__ == "__main__":
     ground_truth_path = 'path/to/ground_truth.json'
     predict_path = 'path/to/predictions.json'
-    main(ground_truth_path, predict_path)
-
+    # set to the category file for per-level scores
+    category_file_path = None
+    main(ground_truth_path, predict_path, category_file_path)
@@ -0,0 +1,61 @@
+import atexit
+import builtins
+import json
+import sys
+import time
+
+HEAVY_MODULES = ("torch", "transformers", "sklearn", "lmdeploy", "numpy", "fastapi")
+
+class ImportProfiler:
+    # Wraps __import__ and charges the time of every first import to the
+    # top-level package our code asked for, nested imports included.
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = {}
+        self.depth = 0
+        self.original_import = None
+
+    def install(self):
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        top = name.partition(".")[0]
+        if level or self.depth or top in sys.modules:
+            self.depth += 1
+            try:
+                return self.original_import(name, globals, locals, fromlist, level)
+            finally:
+                self.depth -= 1
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            self.depth -= 1
+            self.timings[top] = self.timings.get(top, 0.0) + time.perf_counter() - start
+
+    def report(self, top=15):
+        imports = sorted(self.timings.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "seconds_since_start": time.perf_counter() - self.start,
+            "import_seconds": sum(self.timings.values()),
+            "heavy_modules_loaded": [module for module in HEAVY_MODULES if module in sys.modules],
+            "slowest_imports": {module: seconds for module, seconds in imports[:top]},
+        }
+
+installed = None
+
+def install_if_requested(argv=None):
+    # Call first thing in a script; with --import-profile on the command line
+    # the report is printed to stderr when the process exits. Scripts import
+    # each other, so only the first call installs a profiler and later ones
+    # return it.
+    global installed
+    argv = sys.argv if argv is None else argv
+    if installed is not None or "--import-profile" not in argv:
+        return installed
+    installed = ImportProfiler()
+    installed.install()
+    atexit.register(lambda: print(f"Import profile: {json.dumps(installed.report(), indent=4)}", file=sys.stderr))
+    return installed
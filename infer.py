@@ -1,124 +1,180 @@
+import import_profile
+import_profile.install_if_requested()
 import json
 import os
-import torch
 import time
 import re
 import subprocess
-from transformers import AutoModelForCausalLM, AutoTokenizer
-
-def load_model_and_tokenizer(local_model_path, device):
-    model = AutoModelForCausalLM.from_pretrained(
-        local_model_path,
-        torch_dtype=torch.float16,
-        device_map="auto"
-    )
-    tokenizer = AutoTokenizer.from_pretrained(local_model_path)
-    return model, tokenizer
+import argparse
+import hashlib
+import heapq
+import multiprocessing
+from category_hierarchy import load_category_hierarchy
+from classifier_cache import ClassifierCache, file_fingerprint, model_fingerprint
+from output_writer import JsonlWriter, finalize_output, iter_jsonl_records
+from checkpoint import Checkpoint, query_hash
+from spans import align_response, merge_spans, span_agreement
+from pipeline import PipelinedRunner
+from response_stream import iter_grouped_responses
+from backends import make_backend
+from traversal import TraversalPlanner
+from telemetry import metrics
 
 def extract_entities_with_positions(sentence, response):
-    entities = []
-    for match in re.finditer(r"##(.*?)##", response):
-        entity_text = match.group(1)
-        start_idx = sentence.find(entity_text)
-        if start_idx != -1:
-            end_idx = start_idx + len(entity_text)
-            entities.append({
-                "text": entity_text,
-                "start": start_idx,
-                "end": end_idx
-            })
-        else:
-            for m in re.finditer(re.escape(entity_text), sentence):
-                entities.append({
-                    "text": entity_text,
-                    "start": m.start(),
-                    "end": m.end()
-                })
-                break
-    return entities
-
-def merge_entities(entities_list):
-    merged_entities = []
-    for entities in entities_list:
-        for entity in entities:
-            overlap = False
-            for m_entity in merged_entities:
-                if not (entity['end'] <= m_entity['start'] or entity['start'] >= m_entity['end']):
-                    if (entity['end'] - entity['start']) > (m_entity['end'] - m_entity['start']):
-                        m_entity['text'] = entity['text']
-                        m_entity['start'] = entity['start']
-                        m_entity['end'] = entity['end']
-                    overlap = True
-                    break
-            if not overlap:
-                merged_entities.append(entity)
-    return merged_entities
-
-def categorize_entities(entities, original_sentence, model2, tokenizer2, device, category_file_path):
-    with open(category_file_path, "r", encoding="utf-8") as f:
-        category_data = json.load(f, strict=False)
-
-    first_level = category_data["first-level"].lower()
-    first_level_category = []
-    second_level_category = []
-    entity_categories = []
-
-    for entity in entities:
-        entity_lower = entity.lower()
-        query = f'The ##{entity}## in the sentence: "{original_sentence}" belong to which entity in the first list: {first_level}?'
-        entity_type = generate_response(model2, tokenizer2, query, device).strip().lower()
-        first_level_category.append(entity_type)
-
-    if not "second-level" in category_data:
-        return first_level_category
-
-    for count, entity in enumerate(entities):
-        if first_level_category[count] not in category_data["second-level"]:
-            return []
-        second_level = category_data["second-level"][first_level_category[count]].lower()
-        entity_lower = entity.lower()
-        query = f'The ##{entity_lower}## in the sentence: "{original_sentence}" belong to which entity in the second list: {second_level}?'
-        entity_type = generate_response(model2, tokenizer2, query, device).strip().lower()
-        second_level_category.append(entity_type)
-
-    if not "third-level" in category_data:
-        return second_level_category
-
-    for count, entity in enumerate(entities):
-        if second_level_category[count] not in category_data["third-level"]:
-            return []
-        third_level = category_data["third-level"][second_level_category[count]].lower()
-        entity_lower = entity.lower()
-        query = f'The ##{entity_lower}## in the sentence: "{original_sentence}" belong to which entity in the third list: {third_level}?'
-        entity_type = generate_response(model2, tokenizer2, query, device).strip().lower()
-        entity_categories.append(entity_type)
-
-    return entity_categories
-
-def generate_response(model, tokenizer, query, device):
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant."},
-        {"role": "user", "content": query}
-    ]
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True
-    )
-    
-    model_inputs = tokenizer([text], return_tensors="pt").to(device)
-    
-    generated_ids = model.generate(
-        input_ids=model_inputs.input_ids,
-        max_new_tokens=512,
-    )
-    
-    generated_ids = [
-        output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-    ]
-    
-    response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-    return response
+    with metrics.timer("align_seconds"):
+        return align_response(sentence, response)
+
+def merge_entities(entities_list, policy="longest", min_support=1):
+    with metrics.timer("merge_seconds"):
+        return merge_spans(entities_list, policy, min_support)
+
+def build_query(entity, original_sentence, ordinal, label_list):
+    return f'The ##{entity}## in the sentence: "{original_sentence}" belong to which entity in the {ordinal} list: {label_list}?'
+
+def build_joint_query(entities, original_sentence, ordinal, label_list):
+    marked = ", ".join(f"##{entity}##" for entity in entities)
+    return (f'The entities {marked} in the sentence: "{original_sentence}" belong to which entity in the {ordinal} list: {label_list}? '
+            f'Answer with one "entity: label" line per entity.')
+
+def parse_joint_response(response, entities, candidates):
+    # {entity: label} for every entity the answer gives a valid label. Takes
+    # "entity: label" lines (numbered or bulleted too), a JSON object, or bare
+    # labels in entity order; anything else is left out and falls back to a
+    # per-entity query.
+    wanted = {entity.lower(): entity for entity in entities}
+    pairs = []
+    text = response.strip()
+    if text.startswith("{"):
+        try:
+            pairs = [(str(name), str(label)) for name, label in json.loads(text).items()]
+        except (ValueError, AttributeError):
+            pairs = []
+    bare = []
+    if not pairs:
+        for line in text.splitlines():
+            line = re.sub(r'^\s*(?:[-*]|\d+[.)])\s*', '', line).strip()
+            if not line:
+                continue
+            name, separator, label = line.rpartition(":")
+            if separator:
+                pairs.append((name, label))
+            else:
+                bare.append(line)
+        if not pairs and len(bare) == len(entities):
+            pairs = list(zip(entities, bare))
+
+    labels = {}
+    for name, label in pairs:
+        name = name.strip().lower()
+        if name not in wanted:
+            name = name.strip('#"\' ')
+        label = label.strip().strip('"\'.,').lower()
+        if name in wanted and label in candidates:
+            labels.setdefault(wanted[name], label)
+    return labels
+
+def classify_joint(planned, items, depth, ordinal, backend, batch_size=8, max_batch_tokens=4096, cache=None):
+    # One prompt per sentence and label list for the entities of `planned`
+    # that share them; returns a label per entry of `planned`, None where the
+    # answer did not give a valid one.
+    groups = {}
+    for i, (index, entity_index, label_list, candidates) in enumerate(planned):
+        entity = items[index][0][entity_index]
+        entity = entity if depth == 0 else entity.lower()
+        groups.setdefault((index, label_list), (candidates, {}))[1].setdefault(entity, []).append(i)
+    groups = {key: group for key, group in groups.items() if len(group[1]) > 1}
+
+    queries = [build_joint_query(list(entities), items[index][1], ordinal, label_list) for (index, label_list), (_, entities) in groups.items()]
+    responses = [None] * len(queries)
+    if cache is not None:
+        responses = [cache.get(query, "joint") for query in queries]
+    missing = [i for i, response in enumerate(responses) if response is None]
+    if missing:
+        generated = backend.generate([queries[i] for i in missing], batch_size, max_batch_tokens)
+        for i, response in zip(missing, generated):
+            responses[i] = response
+            if cache is not None:
+                cache.put(queries[i], response, "joint")
+
+    labels = [None] * len(planned)
+    for ((candidates, entities), response) in zip(groups.values(), responses):
+        parsed = parse_joint_response(response, list(entities), candidates)
+        for entity, positions in entities.items():
+            metrics.inc("joint_entities_total", result="parsed" if entity in parsed else "fallback")
+            for i in positions:
+                labels[i] = parsed.get(entity)
+    return labels
+
+def classify_query(backend, query, labels, mode="generate", cache=None):
+    if cache is not None:
+        label = cache.get(query, mode)
+        if label is not None:
+            return label
+    if mode == "score":
+        label = backend.score(query, labels)[0]
+    else:
+        label = backend.generate_one(query).strip().lower()
+    if cache is not None:
+        cache.put(query, label, mode)
+    return label
+
+def categorize_entities(entities, original_sentence, backend, hierarchy, mode="generate", cache=None, max_depth=None):
+    planner = TraversalPlanner(hierarchy, [entities], max_depth)
+
+    for depth, ordinal in planner.levels():
+        with metrics.timer("categorize_level_seconds", level=ordinal):
+            queries = planner.plan(depth)
+            labels = []
+            for _, index, label_list, candidates in queries:
+                entity = entities[index]
+                query = build_query(entity if depth == 0 else entity.lower(), original_sentence, ordinal, label_list)
+                labels.append(classify_query(backend, query, candidates, mode, cache))
+            planner.resolve(queries, labels)
+
+    return planner.finish()[0]
+
+def categorize_entities_batch(items, backend, hierarchy, batch_size=8, max_batch_tokens=4096, mode="generate", cache=None, max_depth=None, joint=False):
+    # Same decisions as categorize_entities, but every query of one level is
+    # generated together for all sentences in `items` [(entities, sentence), ...].
+    # With joint (generate mode only) the entities of a sentence sharing a
+    # label list are asked in one prompt first, and only those the answer
+    # leaves unlabelled get their own query.
+    planner = TraversalPlanner(hierarchy, [entities for entities, _ in items], max_depth)
+
+    for depth, ordinal in planner.levels():
+        level_start = time.perf_counter()
+        planned = planner.plan(depth)
+        queries = []
+        candidates = []
+        for index, entity_index, label_list, entity_candidates in planned:
+            entities, original_sentence = items[index]
+            entity = entities[entity_index]
+            queries.append(build_query(entity if depth == 0 else entity.lower(), original_sentence, ordinal, label_list))
+            candidates.append(entity_candidates)
+
+        responses = [None] * len(queries)
+        if cache is not None:
+            responses = [cache.get(query, mode) for query in queries]
+        missing = [i for i, response in enumerate(responses) if response is None]
+        if joint and mode == "generate" and missing:
+            joint_labels = classify_joint([planned[i] for i in missing], items, depth, ordinal, backend, batch_size, max_batch_tokens, cache)
+            for i, label in zip(missing, joint_labels):
+                responses[i] = label
+            missing = [i for i in missing if responses[i] is None]
+        if mode == "score":
+            for i in missing:
+                responses[i] = backend.score(queries[i], candidates[i])[0]
+        elif missing:
+            generated = backend.generate([queries[i] for i in missing], batch_size, max_batch_tokens)
+            for i, response in zip(missing, generated):
+                responses[i] = response.strip().lower()
+        if cache is not None:
+            for i in missing:
+                cache.put(queries[i], responses[i], mode)
+        planner.resolve(planned, [response.strip().lower() for response in responses])
+        metrics.observe("categorize_level_seconds", time.perf_counter() - level_start, level=ordinal)
+
+    return planner.finish()
 
 def clear_infer_result_dir(directory):
     for filename in os.listdir(directory):
@@ -131,73 +187,418 @@ def clear_infer_result_dir(directory):
 def run_bash_script():
     subprocess.run(['/bin/bash', './extract.sh'], check=True)
 
-def process_json_input(output_file, model2, tokenizer2, device, repeat, limit, category_file_path):
-    infer_result_dir = './model/stage1/zeroshot/1b-sft/infer_result/'
-
-    responses_dict = {}
-    for filename in os.listdir(infer_result_dir):
-        file_path = os.path.join(infer_result_dir, filename)
-        if os.path.isfile(file_path) and filename.endswith('.jsonl'):
-            with open(file_path, 'r', encoding='utf-8') as f_json:
-                for k, line in enumerate(f_json):
-                    try:
-                        data_json = json.loads(line)
-                        query = data_json.get('query', '')
-                        response = data_json.get('response', '')
-                        if query not in responses_dict:
-                            responses_dict[query] = []
-                        responses_dict[query].append(response)
-                    except json.JSONDecodeError as e:
-                        print(f'Error decoding JSON from {file_path}: {e}')
-
-    result_data = {}
-    start_time = time.time()
-    count = 1
+def load_stage1_queries(dataset_path):
+    # Sentences of a stage-1 dataset: the conversation list written by
+    # stage1_trans.py, or JSONL lines with a "query". Duplicates are skipped.
+    seen = set()
+    with open(dataset_path, 'r', encoding='utf-8') as f:
+        if dataset_path.endswith('.jsonl'):
+            queries = (json.loads(line)['query'] for line in f if line.strip())
+        else:
+            with metrics.timer("file_load_seconds", file="dataset"):
+                queries = [item['conversations'][0]['value'] for item in json.load(f)]
+        for query in queries:
+            metrics.inc("input_records_total", source="dataset")
+            if query not in seen:
+                seen.add(query)
+                yield query
 
-    for query, responses in responses_dict.items():
-        if responses:
-            entities_list = []
-            for response in responses:
-                entities = extract_entities_with_positions(query, response)
-                entities_list.append(entities)
-            merged_entities = merge_entities(entities_list)
-            if merged_entities:
-                entities_text = [entity['text'] for entity in merged_entities]
-                categories = categorize_entities(entities_text, query, model2, tokenizer2, device, category_file_path)
-                if not categories:
-                    continue
-                result_data[f"sentence{count}"] = {
-                    "sentence": query,
-                    "entity": entities_text,
-                    "category": categories
-                }
-                count += 1
+def iter_windows(items, size):
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def extract_responses(backend, queries, repeat=1, window=16, batch_size=8, max_batch_tokens=4096, max_new_tokens=2048, initial_samples=1, min_agreement=None):
+    # Stage 1 in process: sampled extractor responses per sentence, generated
+    # for `window` sentences at a time and yielded as (query, [responses]) as
+    # soon as their window is done. Without min_agreement every sentence gets
+    # `repeat` samples. With it, every sentence first gets `initial_samples`
+    # and only those whose span_agreement is below min_agreement draw more,
+    # one round at a time, up to `repeat`.
+    for chunk in iter_windows(queries, window):
+        if min_agreement is None:
+            samples = backend.sample(chunk, repeat, batch_size, max_batch_tokens, max_new_tokens)
+            metrics.inc("extractor_samples_total", len(chunk) * repeat, round="initial")
         else:
+            first = min(initial_samples, repeat)
+            samples = backend.sample(chunk, first, batch_size, max_batch_tokens, max_new_tokens)
+            metrics.inc("extractor_samples_total", len(chunk) * first, round="initial")
+            spans = [[extract_entities_with_positions(query, response) for response in responses] for query, responses in zip(chunk, samples)]
+            uncertain = [i for i in range(len(chunk)) if first < repeat and span_agreement(spans[i]) < min_agreement]
+            metrics.inc("extractor_uncertain_sentences_total", len(uncertain))
+            while uncertain:
+                extra = backend.sample([chunk[i] for i in uncertain], 1, batch_size, max_batch_tokens, max_new_tokens)
+                metrics.inc("extractor_samples_total", len(uncertain), round="extra")
+                for i, responses in zip(uncertain, extra):
+                    samples[i].extend(responses)
+                    spans[i].extend(extract_entities_with_positions(chunk[i], response) for response in responses)
+                uncertain = [i for i in uncertain if len(samples[i]) < repeat and span_agreement(spans[i]) < min_agreement]
+        for query, responses in zip(chunk, samples):
+            yield query, responses
+
+def extract_options(settings):
+    return dict(initial_samples=settings["initial_samples"], min_agreement=settings["min_agreement"])
+
+def process_json_input(output_file, backend, repeat, limit, category_file_path, infer_result_dir='./model/stage1/zeroshot/1b-sft/infer_result/', **options):
+    records = iter_grouped_responses(infer_result_dir, repeat)
+    classify_responses(records, output_file, backend, limit, category_file_path, **options)
+
+def label_window(records, backend, hierarchy, batch_size=8, max_batch_tokens=4096, mode="generate", cache=None, merge_policy="longest", min_support=1, max_depth=None, joint=False):
+    # records: a window of (query, [extractor responses]). Returns one
+    # (query, entities, categories) per record; categories is [] when the
+    # sentence has no labelled entities. Every
+    # sentence is traced with its own alignment and merge time plus the
+    # categorization time of the window it was classified in.
+    pending = []
+    prepare_seconds = {}
+    for query, responses in records:
+        if not responses:
             print(f"No responses found for query: {query}")
+            continue
+        start_time = time.perf_counter()
+        entities_list = []
+        for response in responses:
+            entities = extract_entities_with_positions(query, response)
+            entities_list.append(entities)
+        # spans agreed on by fewer than min_support samples are never classified
+        merged_entities = merge_entities(entities_list, merge_policy, min_support)
+        if merged_entities:
+            pending.append((query, [entity['text'] for entity in merged_entities]))
+        prepare_seconds[query] = time.perf_counter() - start_time
 
-        if limit != -1 and count >= limit:
+    start_time = time.perf_counter()
+    if len(pending) == 1 and not joint:
+        sentence, entities_text = pending[0]
+        categories_list = [categorize_entities(entities_text, sentence, backend, hierarchy, mode, cache, max_depth)]
+    elif pending:
+        items = [(entities_text, sentence) for sentence, entities_text in pending]
+        categories_list = categorize_entities_batch(items, backend, hierarchy, batch_size, max_batch_tokens, mode, cache, max_depth, joint)
+    else:
+        categories_list = []
+    categorize_seconds = time.perf_counter() - start_time if pending else 0.0
+
+    labelled = {}
+    for (sentence, entities_text), categories in zip(pending, categories_list):
+        # entities the classifier answered outside its list are left out
+        kept = [(entity, category) for entity, category in zip(entities_text, categories) if category is not None]
+        labelled[sentence] = ([entity for entity, _ in kept], [category for _, category in kept])
+    for query, seconds in prepare_seconds.items():
+        entities_text = labelled.get(query, ([], []))[0]
+        metrics.trace(query, seconds + (categorize_seconds if entities_text else 0.0), entities=len(entities_text), window=len(pending))
+    return [(query,) + labelled.get(query, ([], [])) for query, _ in records]
+
+def write_windows(labelled_windows, output_file, limit, checkpoint=None):
+    # Writes labelled windows in order, numbering kept sentences sentence1,
+    # sentence2, ... and checkpointing after every window.
+    if checkpoint is not None:
+        writer = JsonlWriter(output_file, append=True, truncate_to=checkpoint.offset)
+        count = checkpoint.count
+        if len(checkpoint):
+            print(f"Resuming after {len(checkpoint)} queries at sentence{count}")
+    else:
+        writer = JsonlWriter(output_file)
+        count = 1
+    start_time = time.time()
+
+    # the limit is checked before a window is pulled, so a finished run
+    # classifies nothing more when rerun
+    labelled_windows = iter(labelled_windows)
+    while limit == -1 or count < limit:
+        labelled = next(labelled_windows, None)
+        if labelled is None:
             break
+        written = []
+        for sentence, entities_text, categories in labelled:
+            if categories:
+                if limit != -1 and count >= limit:
+                    break
+                writer.write(f"sentence{count}", {
+                    "sentence": sentence,
+                    "entity": entities_text,
+                    "category": categories
+                })
+                count += 1
+            written.append(sentence)
 
-        with open(output_file, "w", encoding="utf-8") as f_out:
-            json.dump(result_data, f_out, indent=4, ensure_ascii=False)
+        # queries cut off by the limit stay out of the checkpoint, so a
+        # resume with a higher limit labels them again
+        if checkpoint is not None:
+            writer.sync()
+            checkpoint.commit(written, count, writer.tell())
 
         elapsed_time = time.time() - start_time
         print(f"Processed {count} sentences - Elapsed time: {elapsed_time:.2f} seconds")
 
-def main():
-    device = "cuda"
-    repeat = 3
-    limit = 1000
-    local_model_path2 = "./model/classifier/zeroshot/1b-sft"
-    output_file = "output.json"
-    category_file_path = "./eval/category/category_file_path"
+    writer.close()
+
+def classify_responses(records, output_file, backend, limit, category_file_path, window=1, checkpoint=None, **label_options):
+    # records: iterable of (query, [extractor responses]), classified `window`
+    # queries at a time
+    hierarchy = load_category_hierarchy(category_file_path)
+    if checkpoint is not None:
+        records = ((query, responses) for query, responses in records if query not in checkpoint)
+    labelled_windows = (
+        label_window(chunk, backend, hierarchy, **label_options)
+        for chunk in iter_windows(records, window)
+    )
+    write_windows(labelled_windows, output_file, limit, checkpoint)
+
+def default_settings():
+    return dict(
+        device="cuda",
+        # extractor samples per sentence; with min_agreement set this is the
+        # budget: every sentence gets initial_samples, and only those whose
+        # span_agreement stays below min_agreement (0.5 to 1.0, e.g. 0.8) get more
+        repeat=3,
+        initial_samples=2,
+        min_agreement=None,
+        limit=1000,
+        # window > 1 classifies that many sentences per level in padded batches
+        window=1,
+        batch_size=8,
+        max_batch_tokens=4096,
+        # "generate" decodes the answer; "score" ranks the candidate labels in one forward pass
+        mode="generate",
+        # how extractor samples are merged: "longest", "vote" or "union"
+        merge_policy="longest",
+        min_support=1,
+        # deepest category level to classify into (1 = first-level only), None for all
+        max_depth=None,
+        # label all entities of a sentence in one classifier prompt per level,
+        # falling back to per-entity prompts for the ones it gets wrong
+        joint=False,
+        # bound on the key/value states kept for shared prompt prefixes, 0 disables it
+        prefix_cache_bytes=1 << 30,
+        # decisions are memoized here across runs, None disables it
+        cache_path="classifier_cache.sqlite",
+        # "hf" (transformers), "lmdeploy", or "fake": a deterministic stand-in
+        # answering from the GEIC file fake_gold_path after fake_latency seconds
+        backend="hf",
+        fake_gold_path="./DynamicNER/example.json",
+        fake_latency=0.0,
+        fake_drop_rate=0.0,
+        # "swift" reads the jsonl files extract.sh leaves in infer_result_dir; "inprocess"
+        # runs the extractor here and streams its responses into the classifier
+        extractor="swift",
+        infer_result_dir="./model/stage1/zeroshot/1b-sft/infer_result/",
+        local_model_path1="./model/extractor/zeroshot/1b-sft",
+        dataset_path="your_path",
+        # with the in-process extractor, run extraction and classification as a
+        # pipeline of worker threads joined by bounded queues
+        pipelined=False,
+        extract_workers=1,
+        classify_workers=1,
+        queue_size=4,
+        local_model_path2="./model/classifier/zeroshot/1b-sft",
+        # one JSONL record per sentence, converted to the sentenceN layout of
+        # evaluate.py at the end unless output_file is None
+        stream_file="output.jsonl",
+        output_file="output.json",
+        # processed queries are logged here; a rerun skips them and keeps the
+        # sentence numbering. Set resume to False to start over.
+        checkpoint_file="output.ckpt",
+        resume=True,
+        # documents.py: windows of document_max_tokens tokens ("words" as in
+        # BIO_trans.py, "chars" for zh/ja as in BIO_trans_zh.py), neighbours
+        # sharing document_overlap of them
+        document_tokenizer="words",
+        document_max_tokens=256,
+        document_overlap=32,
+        # counters, latency histograms and the slowest sentences by trace id,
+        # as JSON and in the Prometheus text format; None skips either file
+        metrics_file="metrics.json",
+        prometheus_file="metrics.prom",
+        category_file_path="./eval/category/category_file_path",
+    )
+
+def load_backend(settings, model_path):
+    return make_backend(
+        settings["backend"],
+        model_path,
+        settings["device"],
+        prefix_cache_bytes=settings["prefix_cache_bytes"],
+        gold_path=settings["fake_gold_path"],
+        category_file_path=settings["category_file_path"],
+        latency=settings["fake_latency"],
+        drop_rate=settings["fake_drop_rate"],
+    )
+
+def load_classifier(settings):
+    # the hf model is loaded on the first cache miss, so fully cached runs never load torch
+    backend2 = load_backend(settings, settings["local_model_path2"])
+    cache = None
+    if settings["cache_path"]:
+        # the fake answers from its gold file, so that is its "model"
+        backend_inputs = f"{file_fingerprint(settings['fake_gold_path'])}:{settings['fake_drop_rate']}" if settings["backend"] == "fake" else ""
+        cache = ClassifierCache(settings["cache_path"], settings["local_model_path2"], settings["category_file_path"],
+                                backend=settings["backend"], backend_inputs=backend_inputs)
+    label_options = dict(
+        batch_size=settings["batch_size"],
+        max_batch_tokens=settings["max_batch_tokens"],
+        mode=settings["mode"],
+        cache=cache,
+        merge_policy=settings["merge_policy"],
+        min_support=settings["min_support"],
+        max_depth=settings["max_depth"],
+        joint=settings["joint"],
+    )
+    return backend2, label_options
 
-    with open(output_file, "w", encoding="utf-8") as f_out:
-        f_out.write("")
+def close_classifier(backend2, label_options):
+    print(f"Classifier backend: {backend2.stats()}")
+    if label_options["cache"] is not None:
+        print(f"Classifier cache: {label_options['cache'].stats()}")
+        label_options["cache"].close()
+
+def run_fingerprint(settings):
+    # What the sentences a checkpoint records depend on: the input, the
+    # classifier and the category file, fingerprinted like ClassifierCache does.
+    source = settings["dataset_path"] if settings["extractor"] == "inprocess" else settings["infer_result_dir"]
+    parts = [
+        settings["extractor"],
+        model_fingerprint(source) if os.path.isdir(source) else file_fingerprint(source),
+        settings["backend"],
+        model_fingerprint(settings["local_model_path2"]),
+        file_fingerprint(settings["category_file_path"]),
+    ]
+    if settings["backend"] == "fake":
+        parts += [file_fingerprint(settings["fake_gold_path"]), str(settings["fake_drop_rate"])]
+    return hashlib.sha1(":".join(parts).encode("utf-8")).hexdigest()
+
+def run_inference(settings):
+    repeat = settings["repeat"]
+    window = settings["window"]
+    backend2, label_options = load_classifier(settings)
+
+    if not settings["resume"] and os.path.exists(settings["checkpoint_file"]):
+        os.remove(settings["checkpoint_file"])
+    checkpoint = Checkpoint(settings["checkpoint_file"], run_fingerprint(settings))
+
+    if settings["extractor"] == "inprocess":
+        backend1 = load_backend(settings, settings["local_model_path1"])
+        queries = (query for query in load_stage1_queries(settings["dataset_path"]) if query not in checkpoint)
+        if settings["pipelined"]:
+            hierarchy = load_category_hierarchy(settings["category_file_path"])
+            runner = PipelinedRunner(
+                lambda chunk: list(extract_responses(backend1, chunk, repeat, len(chunk), settings["batch_size"], settings["max_batch_tokens"], **extract_options(settings))),
+                lambda records: label_window(records, backend2, hierarchy, **label_options),
+                settings["extract_workers"],
+                settings["classify_workers"],
+                settings["queue_size"],
+            )
+            write_windows(runner.run(iter_windows(queries, window)), settings["stream_file"], settings["limit"], checkpoint)
+            print(f"Pipeline: {runner.report()}")
+        else:
+            records = extract_responses(backend1, queries, repeat, max(window, settings["batch_size"]), settings["batch_size"], settings["max_batch_tokens"], **extract_options(settings))
+            classify_responses(records, settings["stream_file"], backend2, settings["limit"], settings["category_file_path"], window, checkpoint, **label_options)
+    else:
+        process_json_input(settings["stream_file"], backend2, repeat, settings["limit"], settings["category_file_path"], settings["infer_result_dir"], window=window, checkpoint=checkpoint, **label_options)
+    checkpoint.close()
+    close_classifier(backend2, label_options)
+
+def shard_of(query, workers):
+    return int(query_hash(query), 16) % workers
+
+def iter_indexed_windows(settings, keep, backend1=None):
+    # Windows of (input position, (query, responses)) for the queries `keep`
+    # accepts; positions are those of a serial run over the same input.
+    window = settings["window"]
+    if settings["extractor"] == "inprocess":
+        queries = ((index, query) for index, query in enumerate(load_stage1_queries(settings["dataset_path"])) if keep(query))
+        for chunk in iter_windows(queries, window):
+            records = extract_responses(backend1, [query for _, query in chunk], settings["repeat"], len(chunk), settings["batch_size"], settings["max_batch_tokens"], **extract_options(settings))
+            yield [(index, record) for (index, _), record in zip(chunk, records)]
+    else:
+        records = enumerate(iter_grouped_responses(settings["infer_result_dir"], settings["repeat"]))
+        yield from iter_windows(((index, record) for index, record in records if keep(record[0])), window)
+
+def run_shard(settings, shard, workers, threads):
+    # One worker process of run_sharded: classifies the queries whose stable
+    # hash falls into `shard` and writes them keyed by input position.
+    if settings["backend"] == "hf":
+        import torch
+
+        torch.set_num_threads(threads)
+    backend2, label_options = load_classifier(settings)
+    hierarchy = load_category_hierarchy(settings["category_file_path"])
+    backend1 = None
+    if settings["extractor"] == "inprocess":
+        backend1 = load_backend(settings, settings["local_model_path1"])
+
+    limit = settings["limit"]
+    shard_file = f"{settings['stream_file']}.shard{shard}"
+    kept = 0
+    with JsonlWriter(shard_file) as writer:
+        for chunk in iter_indexed_windows(settings, lambda query: shard_of(query, workers) == shard, backend1):
+            labelled = label_window([record for _, record in chunk], backend2, hierarchy, **label_options)
+            for (index, _), (sentence, entities_text, categories) in zip(chunk, labelled):
+                if categories:
+                    writer.write(index, {
+                        "sentence": sentence,
+                        "entity": entities_text,
+                        "category": categories
+                    })
+                    kept += 1
+            # a serial run never keeps more than `limit` sentences from any shard
+            if limit != -1 and kept >= limit:
+                break
+    close_classifier(backend2, label_options)
+    return shard_file, metrics.snapshot()
+
+def merge_shards(shard_files, output_file, limit):
+    # Shard files are ordered by input position, so a k-way merge restores the
+    # serial order and numbering.
+    records = heapq.merge(*[iter_jsonl_records(shard_file) for shard_file in shard_files], key=lambda record: record["id"])
+    count = 1
+    with JsonlWriter(output_file) as writer:
+        for record in records:
+            if limit != -1 and count >= limit:
+                break
+            record.pop("id")
+            writer.write(f"sentence{count}", record)
+            count += 1
+
+def run_sharded(settings, workers, threads_per_worker=None):
+    # Checkpoints are per serial run, so sharded runs always start over.
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        results = pool.starmap(run_shard, [(settings, shard, workers, threads) for shard in range(workers)])
+    shard_files = []
+    for shard_file, snapshot in results:
+        shard_files.append(shard_file)
+        metrics.merge(snapshot)
+    merge_shards(shard_files, settings["stream_file"], settings["limit"])
+    for shard_file in shard_files:
+        os.remove(shard_file)
+    # the stream_file no longer matches what a serial run checkpointed
+    if os.path.exists(settings["checkpoint_file"]):
+        os.remove(settings["checkpoint_file"])
+
+def main():
+    parser = argparse.ArgumentParser(description='Classify the entities found by the stage-1 extractor')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes; queries are sharded by a stable hash (default: 1)')
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help='Torch threads per worker (default: CPU count / workers)')
+    parser.add_argument('--import-profile', action='store_true',
+                        help='Print where startup time went on exit')
+    args = parser.parse_args()
 
-    model2, tokenizer2 = load_model_and_tokenizer(local_model_path2, device)
+    settings = default_settings()
+    if args.workers > 1:
+        run_sharded(settings, args.workers, args.threads_per_worker)
+    else:
+        run_inference(settings)
 
-    process_json_input(output_file, model2, tokenizer2, device, repeat, limit, category_file_path)
+    if settings["output_file"]:
+        finalize_output(settings["stream_file"], settings["output_file"])
+    metrics.write(settings["metrics_file"], settings["prometheus_file"])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,33 @@
+class LazyObject:
+    # Stands in for the object factory() returns and only calls it on first
+    # use, so runs that never touch it (every decision cached, parse-only
+    # paths) skip the load and the heavy imports behind it.
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_target", None)
+
+    def _resolve(self):
+        if self._target is None:
+            object.__setattr__(self, "_target", self._factory())
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+def lazy_pair(factory):
+    # Two LazyObjects for the halves of one (a, b) = factory() call, e.g. a
+    # model and its tokenizer, loaded together the first time either is used.
+    loaded = []
+
+    def load(index):
+        if not loaded:
+            loaded.append(factory())
+        return loaded[0][index]
+
+    return LazyObject(lambda: load(0)), LazyObject(lambda: load(1))
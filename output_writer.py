@@ -0,0 +1,63 @@
+import json
+import os
+
+from telemetry import metrics
+
+class JsonlWriter:
+    # Appends one {"id": "sentenceN", "sentence": ..., "entity": [...],
+    # "category": [...]} record per line, flushing to disk every
+    # `fsync_every` records so a crash loses at most that many sentences.
+    def __init__(self, path, fsync_every=100, append=False, truncate_to=None):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+        if truncate_to is not None:
+            # drop records written after the last checkpoint
+            self.file.truncate(truncate_to)
+        self.unsynced = 0
+
+    def write(self, key, record):
+        self.file.write(json.dumps({"id": key, **record}, ensure_ascii=False) + "\n")
+        metrics.inc("output_records_total")
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        with metrics.timer("output_fsync_seconds"):
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def tell(self):
+        self.file.flush()
+        return os.path.getsize(self.path)
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def iter_jsonl_records(jsonl_path):
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def finalize_output(jsonl_path, output_file):
+    # Streams the JSONL records into the {"sentenceN": {...}} layout that
+    # evaluate.py reads, byte-identical to json.dump(..., indent=4).
+    with open(output_file, "w", encoding="utf-8") as f_out:
+        first = True
+        for record in iter_jsonl_records(jsonl_path):
+            key = record.pop("id")
+            value = json.dumps(record, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+            f_out.write(("{\n" if first else ",\n") + f"    {json.dumps(key, ensure_ascii=False)}: {value}")
+            first = False
+        f_out.write("{}" if first else "\n}")
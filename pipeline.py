@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+
+STOP = object()
+
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.windows = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+        self.blocked = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, busy, waiting, blocked):
+        with self.lock:
+            self.windows += 1
+            self.busy += busy
+            self.waiting += waiting
+            self.blocked += blocked
+
+    def report(self, wall):
+        # utilization: share of the workers' wall time spent inside the stage
+        # function; waiting: starved for input; blocked: held up by a full
+        # downstream queue (backpressure).
+        capacity = wall * self.workers
+        return {
+            "workers": self.workers,
+            "windows": self.windows,
+            "busy_seconds": self.busy,
+            "utilization": self.busy / capacity if capacity else 0.0,
+            "waiting": self.waiting / capacity if capacity else 0.0,
+            "blocked": self.blocked / capacity if capacity else 0.0,
+        }
+
+class PipelinedRunner:
+    # Runs extract_fn(window) -> records and classify_fn(records) -> results
+    # in separate worker threads joined by bounded queues, so classification
+    # of window N overlaps extraction of the windows after it. Torch releases
+    # the GIL inside its kernels, which is what lets the stages overlap.
+    # Results are yielded in input order.
+    def __init__(self, extract_fn, classify_fn, extract_workers=1, classify_workers=1, queue_size=4):
+        self.extract_fn = extract_fn
+        self.classify_fn = classify_fn
+        self.queue_size = queue_size
+        self.extract_stats = StageStats("extract", extract_workers)
+        self.classify_stats = StageStats("classify", classify_workers)
+        self.wall = 0.0
+
+    def worker(self, function, stats, inbox, outbox):
+        while True:
+            started = time.perf_counter()
+            item = inbox.get()
+            if item is STOP:
+                return
+            seq, payload = item
+            waited = time.perf_counter() - started
+            started = time.perf_counter()
+            try:
+                result = function(payload)
+            except Exception as e:
+                self.errors.put(e)
+                return
+            busy = time.perf_counter() - started
+            started = time.perf_counter()
+            outbox.put((seq, result))
+            stats.add(busy, waited, time.perf_counter() - started)
+
+    def feed(self, windows, windows_queue, extracted_queue, results_queue, extractors, classifiers):
+        try:
+            for seq, window in enumerate(windows):
+                windows_queue.put((seq, window))
+        except Exception as e:
+            self.errors.put(e)
+        for _ in extractors:
+            windows_queue.put(STOP)
+        for thread in extractors:
+            thread.join()
+        for _ in classifiers:
+            extracted_queue.put(STOP)
+        for thread in classifiers:
+            thread.join()
+        results_queue.put(STOP)
+
+    def run(self, windows):
+        self.errors = queue.Queue()
+        windows_queue = queue.Queue(maxsize=self.queue_size)
+        extracted_queue = queue.Queue(maxsize=self.queue_size)
+        results_queue = queue.Queue(maxsize=self.queue_size)
+        extractors = [
+            threading.Thread(target=self.worker, args=(self.extract_fn, self.extract_stats, windows_queue, extracted_queue), daemon=True)
+            for _ in range(self.extract_stats.workers)
+        ]
+        classifiers = [
+            threading.Thread(target=self.worker, args=(self.classify_fn, self.classify_stats, extracted_queue, results_queue), daemon=True)
+            for _ in range(self.classify_stats.workers)
+        ]
+        feeder = threading.Thread(
+            target=self.feed, args=(windows, windows_queue, extracted_queue, results_queue, extractors, classifiers), daemon=True
+        )
+
+        start_time = time.perf_counter()
+        for thread in extractors + classifiers + [feeder]:
+            thread.start()
+
+        buffered = {}
+        next_seq = 0
+        while True:
+            try:
+                item = results_queue.get(timeout=0.1)
+            except queue.Empty:
+                item = None
+            if not self.errors.empty():
+                raise self.errors.get()
+            if item is None:
+                continue
+            if item is STOP:
+                break
+            seq, result = item
+            buffered[seq] = result
+            while next_seq in buffered:
+                yield buffered.pop(next_seq)
+                next_seq += 1
+            self.wall = time.perf_counter() - start_time
+        self.wall = time.perf_counter() - start_time
+
+    def report(self):
+        return {
+            "wall_seconds": self.wall,
+            "extract": self.extract_stats.report(self.wall),
+            "classify": self.classify_stats.report(self.wall),
+        }
@@ -0,0 +1,113 @@
+import threading
+
+from telemetry import metrics
+from collections import OrderedDict
+
+def past_nbytes(past_key_values):
+    return sum(key.numel() * key.element_size() + value.numel() * value.element_size() for key, value in past_key_values)
+
+def to_legacy(past_key_values):
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+class PrefixKVCache:
+    # Caches the key/value states of prompt prefixes (token id tuples) so that
+    # queries sharing a prefix only prefill their own suffix. Entries are kept
+    # as legacy tuples, which the model never mutates, and evicted LRU once
+    # either bound is exceeded.
+    def __init__(self, model, device=None, max_bytes=1 << 30, max_entries=1024):
+        self.model = model
+        # resolved on first use, so a lazily loaded model stays unloaded until then
+        self._device = device
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, input_ids, prefix_lengths):
+        with self.lock:
+            return self.lookup(input_ids, prefix_lengths)
+
+    def lookup(self, input_ids, prefix_lengths):
+        # Returns (past_key_values, length) for the longest usable boundary in
+        # prefix_lengths. A shorter cached prefix is extended rather than
+        # recomputed, and every boundary on the way is cached for later forks.
+        lengths = sorted({length for length in prefix_lengths if 0 < length < len(input_ids)}, reverse=True)
+        if not lengths:
+            return None, 0
+
+        past_key_values = None
+        cached_length = 0
+        for length in lengths:
+            key = tuple(input_ids[:length])
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                past_key_values = self.entries[key]
+                cached_length = length
+                break
+
+        if cached_length == lengths[0]:
+            self.hits += 1
+            metrics.inc("prefix_cache_lookups_total", result="hit")
+            return past_key_values, cached_length
+        if past_key_values is None:
+            self.misses += 1
+            metrics.inc("prefix_cache_lookups_total", result="miss")
+        else:
+            self.partial_hits += 1
+            metrics.inc("prefix_cache_lookups_total", result="partial")
+
+        for length in reversed(lengths):
+            if length <= cached_length:
+                continue
+            past_key_values = self.extend(input_ids[cached_length:length], past_key_values)
+            cached_length = length
+            self.put(tuple(input_ids[:length]), past_key_values)
+        return past_key_values, cached_length
+
+    @property
+    def device(self):
+        return self._device if self._device is not None else self.model.device
+
+    def extend(self, input_ids, past_key_values=None):
+        import torch
+
+        ids = torch.tensor([input_ids], device=self.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=ids, past_key_values=past_key_values, use_cache=True)
+        return to_legacy(outputs.past_key_values)
+
+    def put(self, key, past_key_values):
+        nbytes = past_nbytes(past_key_values)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= past_nbytes(self.entries.pop(key))
+        self.entries[key] = past_key_values
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= past_nbytes(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.partial_hits + self.misses
+        return {
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.partial_hits) / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+            "evictions": self.evictions,
+        }
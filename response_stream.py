@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import json
+import os
+import tempfile
+
+from checkpoint import query_hash
+from telemetry import metrics
+
+def iter_jsonl_responses(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f_json:
+        for line in f_json:
+            try:
+                data_json = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f'Error decoding JSON from {file_path}: {e}')
+                metrics.inc("input_errors_total", source="infer_result")
+                continue
+            metrics.inc("input_records_total", source="infer_result")
+            yield data_json.get('query', ''), data_json.get('response', '')
+
+class ExternalSorter:
+    # Sorts JSON-serializable tuples with at most `run_size` of them in
+    # memory: full buffers are sorted and spilled to temporary runs, which
+    # are k-way merged at the end.
+    def __init__(self, run_size=100000, tmp_dir=None):
+        self.run_size = run_size
+        self.tmp_dir = tmp_dir
+        self.buffer = []
+        self.runs = []
+
+    def add(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        fd, path = tempfile.mkstemp(suffix='.jsonl', dir=self.tmp_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for record in self.buffer:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.runs.append(path)
+        self.buffer = []
+
+    @staticmethod
+    def read_run(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield tuple(json.loads(line))
+
+    def sorted(self):
+        if self.runs:
+            self.spill()
+            return heapq.merge(*[self.read_run(path) for path in self.runs])
+        self.buffer.sort()
+        return iter(self.buffer)
+
+    def close(self):
+        for path in self.runs:
+            if os.path.exists(path):
+                os.remove(path)
+        self.runs = []
+        self.buffer = []
+
+class ExternalGrouper:
+    # Groups (query, response) pairs by query with bounded memory. Sorting by
+    # (query hash, query, arrival) brings the pairs of a query together; the
+    # groups are then sorted again by their first arrival, so they come out
+    # in the order their queries first showed up in the input.
+    def __init__(self, run_size=100000, tmp_dir=None):
+        self.pairs = ExternalSorter(run_size, tmp_dir)
+        self.groups_by_arrival = ExternalSorter(run_size, tmp_dir)
+        self.seq = 0
+
+    def add(self, query, response):
+        self.pairs.add((query_hash(query), query, self.seq, response))
+        self.seq += 1
+
+    def groups(self):
+        for (_, query), items in itertools.groupby(self.pairs.sorted(), key=lambda record: record[:2]):
+            items = list(items)
+            self.groups_by_arrival.add((items[0][2], query, [record[3] for record in items]))
+        self.pairs.close()
+        for _, query, responses in self.groups_by_arrival.sorted():
+            yield query, responses
+
+    def close(self):
+        self.pairs.close()
+        self.groups_by_arrival.close()
+
+def iter_grouped_responses(infer_result_dir, repeat=None, run_size=100000, tmp_dir=None):
+    # Yields (query, [responses]) from the .jsonl files of repeated swift runs.
+    # Runs over the same dataset list the queries in the same order, so the
+    # files are read in lockstep and a query is yielded as soon as it has
+    # `repeat` responses, or one per file when there are fewer files (or
+    # repeat is None). Incomplete groups, and everything from the first line
+    # where the files disagree (interleaved or truncated runs), are grouped
+    # with an external sort instead and follow in the order their queries
+    # first showed up. A query that shows up again after it was yielded is
+    # dropped, as the dict this replaces would have folded it into the first
+    # group.
+    file_paths = sorted(
+        os.path.join(infer_result_dir, filename)
+        for filename in os.listdir(infer_result_dir)
+        if filename.endswith('.jsonl') and os.path.isfile(os.path.join(infer_result_dir, filename))
+    )
+    readers = [iter_jsonl_responses(file_path) for file_path in file_paths]
+    complete = min(repeat, len(readers)) if repeat is not None else len(readers)
+    grouper = ExternalGrouper(run_size, tmp_dir)
+    yielded = set()
+    group_query = None
+    group_responses = []
+    aligned = True
+
+    def close_group():
+        if len(group_responses) >= complete:
+            return True
+        for response in group_responses:
+            grouper.add(group_query, response)
+        return False
+
+    try:
+        for lines in itertools.zip_longest(*readers):
+            if aligned and None not in lines and all(query == lines[0][0] for query, _ in lines):
+                query = lines[0][0]
+                if query != group_query:
+                    if group_responses and close_group() and query_hash(group_query) not in yielded:
+                        yielded.add(query_hash(group_query))
+                        yield group_query, group_responses
+                    group_query = query
+                    group_responses = []
+                group_responses.extend(response for _, response in lines)
+                continue
+            if aligned:
+                aligned = False
+                # the open group may continue further down, so it joins the sort
+                complete = float('inf')
+                close_group()
+                group_responses = []
+            for line in lines:
+                if line is not None:
+                    grouper.add(*line)
+        if group_responses and close_group() and query_hash(group_query) not in yielded:
+            yielded.add(query_hash(group_query))
+            yield group_query, group_responses
+        for query, responses in grouper.groups():
+            if query_hash(query) not in yielded:
+                yield query, responses
+    finally:
+        grouper.close()
@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from batching import LengthBucketScheduler
+from telemetry import metrics
+
+class MicroBatcher:
+    # Coalesces concurrent submissions into calls of fn(items) -> results.
+    # Items wait in a LengthBucketScheduler keyed by length_fn(item), an
+    # estimate of their prompt length: a bucket becomes a batch once it
+    # holds max_batch items or max_batch_tokens padded tokens, or max_wait
+    # seconds after its oldest item arrived. fn runs in a worker thread, one
+    # batch at a time, so the event loop keeps accepting requests meanwhile.
+    def __init__(self, fn, max_batch=16, max_wait=0.01, length_fn=len, max_batch_tokens=4096):
+        self.fn = fn
+        self.length_fn = length_fn
+        self.scheduler = LengthBucketScheduler(max_batch, max_batch_tokens, max_wait=max_wait)
+        self.queue = None
+        self.task = None
+        self.batches = 0
+        self.items = 0
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future, time.monotonic()))
+        return await future
+
+    async def run(self):
+        while True:
+            deadline = self.scheduler.next_deadline()
+            try:
+                if deadline is None:
+                    arrivals = [await self.queue.get()]
+                else:
+                    arrivals = [await asyncio.wait_for(self.queue.get(), max(0.0, deadline - time.monotonic()))]
+            except asyncio.TimeoutError:
+                arrivals = []
+            # whatever queued up while the last batch ran joins the buckets
+            # with its arrival time, before any deadline is checked
+            while not self.queue.empty():
+                arrivals.append(self.queue.get_nowait())
+            ready = []
+            for item, future, arrived in arrivals:
+                ready.extend(self.scheduler.add((item, future), self.length_fn(item), arrived))
+            for batch in ready + self.scheduler.due():
+                await self.run_batch(batch)
+
+    async def run_batch(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(None, self.fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+        }
+
+class NerEngine:
+    # extract_fn(sentences) -> one list of merged entity spans per sentence
+    # classify_fn([(entities_text, sentence)]) -> one category list per item
+    # close_fn() runs on shutdown, after the last batch, e.g. to commit a cache
+    # Prompt lengths are estimated in words, which is enough to keep short
+    # and long prompts out of each other's batches.
+    def __init__(self, extract_fn, classify_fn, max_batch=16, max_wait=0.01, close_fn=None, max_batch_tokens=4096):
+        self.extractor = MicroBatcher(extract_fn, max_batch, max_wait, lambda sentence: len(sentence.split()), max_batch_tokens)
+        self.classifier = MicroBatcher(
+            classify_fn, max_batch, max_wait,
+            lambda item: len(item[1].split()) + sum(len(entity.split()) for entity in item[0]), max_batch_tokens,
+        )
+        self.close_fn = close_fn
+
+    def start(self):
+        self.extractor.start()
+        self.classifier.start()
+
+    async def stop(self):
+        await self.extractor.stop()
+        await self.classifier.stop()
+        if self.close_fn is not None:
+            self.close_fn()
+
+    async def extract(self, sentence):
+        return await self.extractor.submit(sentence)
+
+    async def classify(self, sentence, entities_text):
+        if not entities_text:
+            return []
+        return await self.classifier.submit((entities_text, sentence))
+
+    def stats(self):
+        return {"extract": self.extractor.stats(), "classify": self.classifier.stats()}
+
+def load_engine(settings, max_batch=16, max_wait=0.01):
+    # Models are loaded once here and shared by every request.
+    from category_hierarchy import load_category_hierarchy
+    from infer import (categorize_entities_batch, close_classifier, extract_entities_with_positions, extract_options,
+                       extract_responses, load_backend, load_classifier, merge_entities)
+
+    backend1 = load_backend(settings, settings["local_model_path1"])
+    backend2, label_options = load_classifier(settings)
+    hierarchy = load_category_hierarchy(settings["category_file_path"])
+
+    def extract(sentences):
+        records = extract_responses(backend1, sentences, settings["repeat"], len(sentences), settings["batch_size"], settings["max_batch_tokens"], **extract_options(settings))
+        return [
+            merge_entities([extract_entities_with_positions(query, response) for response in responses], settings["merge_policy"], settings["min_support"])
+            for query, responses in records
+        ]
+
+    def classify(items):
+        return categorize_entities_batch(
+            items, backend2, hierarchy, settings["batch_size"], settings["max_batch_tokens"], settings["mode"], label_options["cache"], settings["max_depth"], settings["joint"],
+        )
+
+    return NerEngine(extract, classify, max_batch, max_wait, lambda: close_classifier(backend2, label_options), settings["max_batch_tokens"])
+
+class ExtractRequest(BaseModel):
+    sentence: str
+
+class ClassifyRequest(BaseModel):
+    sentence: str
+    entities: List[str]
+
+class NerRequest(BaseModel):
+    sentences: List[str]
+
+def create_app(engine):
+    @asynccontextmanager
+    async def lifespan(app):
+        engine.start()
+        yield
+        await engine.stop()
+
+    app = FastAPI(title="CascadeNER", lifespan=lifespan)
+
+    @app.post("/extract")
+    async def extract(request: ExtractRequest):
+        return {"sentence": request.sentence, "entities": await engine.extract(request.sentence)}
+
+    @app.post("/classify")
+    async def classify(request: ClassifyRequest):
+        categories = await engine.classify(request.sentence, request.entities)
+        return {"sentence": request.sentence, "entity": request.entities, "category": categories}
+
+    @app.post("/ner")
+    async def ner(request: NerRequest):
+        # NDJSON: an "entities" line per sentence as soon as its extraction is
+        # done, then a "categories" line per sentence as its classification is.
+        async def stream():
+            extractions = [asyncio.ensure_future(engine.extract(sentence)) for sentence in request.sentences]
+            classifications = []
+            for index, sentence in enumerate(request.sentences):
+                entities = await extractions[index]
+                yield json.dumps({"index": index, "event": "entities", "sentence": sentence, "entities": entities}, ensure_ascii=False) + "\n"
+                entities_text = [entity["text"] for entity in entities]
+                classifications.append(asyncio.ensure_future(labelled(index, sentence, entities_text)))
+            for finished in asyncio.as_completed(classifications):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+
+        async def labelled(index, sentence, entities_text):
+            categories = await engine.classify(sentence, entities_text)
+            return {"index": index, "event": "categories", "sentence": sentence, "entity": entities_text, "category": categories}
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.get("/stats")
+    async def stats():
+        return engine.stats()
+
+    @app.get("/metrics")
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+    return app
+
+def main():
+    from infer import default_settings
+
+    parser = argparse.ArgumentParser(description='Serve the extractor and classifier over HTTP')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to bind (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000, help='Port to bind (default: 8000)')
+    parser.add_argument('--device', type=str, default='cuda', help='Device for both models (default: cuda)')
+    parser.add_argument('--backend', type=str, default='hf', choices=['hf', 'lmdeploy', 'fake'],
+                        help='Inference backend; "fake" answers from --gold without model weights (default: hf)')
+    parser.add_argument('--gold', type=str, default=None, help='GEIC file the fake backend answers from')
+    parser.add_argument('--extractor-model', type=str, default=None, help='Extractor model path (default: local_model_path1 of infer.py)')
+    parser.add_argument('--classifier-model', type=str, default=None, help='Classifier model path (default: local_model_path2 of infer.py)')
+    parser.add_argument('--category-file', type=str, default=None, help='Category file (default: category_file_path of infer.py)')
+    parser.add_argument('--max-depth', type=int, default=None, help='Deepest category level to classify into (default: all)')
+    parser.add_argument('--joint', action='store_true', help='Label all entities of a sentence in one classifier prompt per level')
+    parser.add_argument('--max-batch', type=int, default=16, help='Most requests coalesced into one model call (default: 16)')
+    parser.add_argument('--max-wait', type=float, default=0.01, help='Seconds a request waits for others to join its batch (default: 0.01)')
+    args = parser.parse_args()
+
+    settings = default_settings()
+    settings["device"] = args.device
+    settings["backend"] = args.backend
+    if args.gold:
+        settings["fake_gold_path"] = args.gold
+    if args.extractor_model:
+        settings["local_model_path1"] = args.extractor_model
+    if args.classifier_model:
+        settings["local_model_path2"] = args.classifier_model
+    if args.category_file:
+        settings["category_file_path"] = args.category_file
+    settings["max_depth"] = args.max_depth
+    settings["joint"] = args.joint
+
+    engine = load_engine(settings, args.max_batch, args.max_wait)
+    uvicorn.run(create_app(engine), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import bisect
+import re
+
+MERGE_POLICIES = ("longest", "vote", "union")
+MARKER = re.compile(r"##(.*?)##")
+
+def strip_markers(response):
+    # Removes the ##...## markers and returns the plain text together with
+    # the (start, end) of every marked span in plain-text coordinates.
+    parts = []
+    marks = []
+    length = 0
+    position = 0
+    for match in MARKER.finditer(response):
+        before = response[position:match.start()]
+        parts.append(before)
+        length += len(before)
+        text = match.group(1)
+        if text:
+            marks.append((length, length + len(text)))
+        parts.append(text)
+        length += len(text)
+        position = match.end()
+    parts.append(response[position:])
+    return "".join(parts), marks
+
+def align_text(plain, sentence, lookahead=32):
+    # Maps every character of `plain` to its offset in `sentence` (-1 when it
+    # has no counterpart) in one forward walk over both strings. Whitespace
+    # differences are skipped; other edits are resynchronised by looking for
+    # the next few characters within `lookahead`, which keeps the walk linear.
+    mapping = [-1] * len(plain)
+    i = 0
+    j = 0
+    while i < len(plain) and j < len(sentence):
+        if plain[i] == sentence[j]:
+            # copy equal runs in halving blocks instead of char by char
+            block = 256
+            while block:
+                chunk = plain[i:i + block]
+                if chunk and chunk == sentence[j:j + len(chunk)]:
+                    mapping[i:i + len(chunk)] = range(j, j + len(chunk))
+                    i += len(chunk)
+                    j += len(chunk)
+                else:
+                    block //= 2
+        elif plain[i].lower() == sentence[j].lower():
+            mapping[i] = j
+            i += 1
+            j += 1
+        elif plain[i].isspace():
+            i += 1
+        elif sentence[j].isspace():
+            j += 1
+        else:
+            anchor = plain[i:i + 4]
+            found = sentence.find(anchor, j, j + lookahead + len(anchor))
+            if found != -1:
+                j = found
+                continue
+            anchor = sentence[j:j + 4]
+            found = plain.find(anchor, i, i + lookahead + len(anchor))
+            if found != -1:
+                i = found
+                continue
+            i += 1
+            j += 1
+    return mapping
+
+def align_response(sentence, response, lookahead=32):
+    # Character offsets of every ##...## span of an extractor response in the
+    # original sentence. Repeated mentions keep their own positions; spans
+    # that cannot be aligned fall back to the next occurrence of their text.
+    plain, marks = strip_markers(response)
+    if plain == sentence:
+        return [{"text": sentence[start:end], "start": start, "end": end} for start, end in marks]
+
+    mapping = align_text(plain, sentence, lookahead)
+    entities = []
+    cursor = 0
+    for plain_start, plain_end in marks:
+        mapped = [mapping[k] for k in range(plain_start, plain_end) if mapping[k] != -1]
+        if mapped:
+            start = mapped[0]
+            end = mapped[-1] + 1
+        else:
+            text = plain[plain_start:plain_end]
+            start = sentence.find(text, cursor)
+            if start == -1:
+                start = sentence.find(text)
+            if start == -1:
+                continue
+            end = start + len(text)
+        entities.append({"text": sentence[start:end], "start": start, "end": end})
+        cursor = end
+    return entities
+
+def count_support(entities_list):
+    # Distinct (start, end) spans with the number of extractor samples that
+    # produced each one; a sample counts once per span.
+    spans = {}
+    for sample, entities in enumerate(entities_list):
+        for entity in entities:
+            key = (entity["start"], entity["end"])
+            if key not in spans:
+                spans[key] = {"text": entity["text"], "start": entity["start"], "end": entity["end"], "samples": set()}
+            spans[key]["samples"].add(sample)
+    return list(spans.values())
+
+class AcceptedStarts:
+    # Which of a fixed, sorted list of start offsets are taken, as a Fenwick
+    # tree of counts: marking one and finding the last taken start before an
+    # offset are both O(log n).
+    def __init__(self, starts):
+        self.starts = starts
+        self.tree = [0] * (len(starts) + 1)
+        self.top = 1 << len(starts).bit_length()
+
+    def add(self, index):
+        index += 1
+        while index < len(self.tree):
+            self.tree[index] += 1
+            index += index & -index
+
+    def count_before(self, offset):
+        # taken starts < offset
+        index = bisect.bisect_left(self.starts, offset)
+        count = 0
+        while index:
+            count += self.tree[index]
+            index -= index & -index
+        return count
+
+    def nth(self, count):
+        # index of the count-th taken start (1-based), by descending the tree
+        index = 0
+        step = self.top
+        while step:
+            if index + step < len(self.tree) and self.tree[index + step] < count:
+                index += step
+                count -= self.tree[index]
+            step >>= 1
+        return index
+
+def select_non_overlapping(candidates, priority):
+    # Greedy interval selection: highest priority first, skipping anything
+    # that overlaps an accepted span. Accepted spans never overlap, so a new
+    # span only has to be checked against the accepted span with the last
+    # start before its end; a Fenwick tree over the candidate starts finds
+    # that one in O(log n), keeping the whole selection O(n log n).
+    by_start = sorted(range(len(candidates)), key=lambda i: candidates[i]["start"])
+    rank = [0] * len(candidates)
+    for position, i in enumerate(by_start):
+        rank[i] = position
+    accepted = AcceptedStarts([candidates[i]["start"] for i in by_start])
+    selected = [None] * len(candidates)
+    for i in sorted(range(len(candidates)), key=lambda i: priority(candidates[i])):
+        span = candidates[i]
+        before = accepted.count_before(span["end"])
+        if before and selected[accepted.nth(before)]["end"] > span["start"]:
+            continue
+        accepted.add(rank[i])
+        selected[rank[i]] = span
+    return [span for span in selected if span is not None]
+
+def union_spans(candidates):
+    # Sweep over spans sorted by start; overlapping spans are stitched into
+    # one covering span whose text is rebuilt from the pieces.
+    merged = []
+    for span in sorted(candidates, key=lambda span: (span["start"], -span["end"])):
+        if merged and span["start"] < merged[-1]["end"]:
+            current = merged[-1]
+            if span["end"] > current["end"]:
+                current["text"] += span["text"][current["end"] - span["start"]:]
+                current["end"] = span["end"]
+            current["samples"] |= span["samples"]
+        else:
+            merged.append(dict(span, samples=set(span["samples"])))
+    return merged
+
+def merge_spans(entities_list, policy="longest", min_support=1):
+    # entities_list holds one list of {"text", "start", "end"} per extractor
+    # sample. Returns non-overlapping spans sorted by start, each with a
+    # "support" count of agreeing samples.
+    #   longest: of overlapping spans keep the longest (then best supported)
+    #   vote:    of overlapping spans keep the best supported (then longest)
+    #   union:   merge overlapping spans into their covering span
+    # Spans supported by fewer than min_support samples are dropped.
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f"Unknown merge policy: {policy}")
+    candidates = count_support(entities_list)
+    if policy == "union":
+        merged = [span for span in union_spans(candidates) if len(span["samples"]) >= min_support]
+    else:
+        candidates = [span for span in candidates if len(span["samples"]) >= min_support]
+        if policy == "longest":
+            priority = lambda span: (span["start"] - span["end"], -len(span["samples"]), span["start"])
+        else:
+            priority = lambda span: (-len(span["samples"]), span["start"] - span["end"], span["start"])
+        merged = select_non_overlapping(candidates, priority)
+    return [
+        {"text": span["text"], "start": span["start"], "end": span["end"], "support": len(span["samples"])}
+        for span in merged
+    ]
+
+def span_agreement(entities_list):
+    # How settled the samples are: for every span found by any sample, the
+    # share of samples on its majority side (found it or not), averaged over
+    # the spans. 1.0 when the samples agree (also on finding nothing), 0.0
+    # for a single sample, which cannot show agreement. A dissenting sample
+    # weighs less with every sample that sides with the majority, so an
+    # uncertain sentence can settle before its budget is spent.
+    if len(entities_list) < 2:
+        return 0.0
+    spans = count_support(entities_list)
+    if not spans:
+        return 1.0
+    samples = len(entities_list)
+    return sum(max(len(span["samples"]), samples - len(span["samples"])) for span in spans) / (samples * len(spans))
@@ -0,0 +1,204 @@
+import bisect
+import heapq
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from checkpoint import query_hash
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "count": self.count, "sum": self.sum, "max": self.max}
+
+    def merge(self, snapshot):
+        for i, count in enumerate(snapshot["counts"]):
+            self.counts[i] += count
+        self.count += snapshot["count"]
+        self.sum += snapshot["sum"]
+        self.max = max(self.max, snapshot["max"])
+
+class SentenceTraces:
+    # Per-sentence latency keyed by trace id (the checkpoint query hash, so a
+    # slow id can be matched back to its sentence). Keeps the `keep` slowest.
+    def __init__(self, keep=100):
+        self.keep = keep
+        self.slowest = []
+        self.latency = Histogram()
+
+    def add(self, sentence, seconds, **details):
+        self.latency.observe(seconds)
+        entry = (seconds, query_hash(sentence), sentence[:80], details)
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, entry)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def snapshot(self):
+        slowest = sorted(self.slowest, key=lambda entry: entry[0], reverse=True)
+        return {
+            "latency": self.latency.snapshot(),
+            "slowest": [
+                {"trace_id": trace_id, "seconds": seconds, "sentence": sentence, **details}
+                for seconds, trace_id, sentence, details in slowest
+            ],
+        }
+
+    def merge(self, snapshot):
+        self.latency.merge(snapshot["latency"])
+        for entry in snapshot["slowest"]:
+            entry = dict(entry)
+            seconds = entry.pop("seconds")
+            trace_id = entry.pop("trace_id")
+            sentence = entry.pop("sentence")
+            heapq.heappush(self.slowest, (seconds, trace_id, sentence, entry))
+        while len(self.slowest) > self.keep:
+            heapq.heappop(self.slowest)
+
+class Metrics:
+    # Process-wide counters and latency histograms with labels, exportable
+    # as JSON or in the Prometheus text format.
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.traces = SentenceTraces()
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = label_key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def trace(self, sentence, seconds, **details):
+        with self.lock:
+            self.traces.add(sentence, seconds, **details)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [{"labels": dict(key), **histogram.snapshot()} for key, histogram in series.items()]
+                    for name, series in self.histograms.items()
+                },
+                "traces": self.traces.snapshot(),
+            }
+
+    def merge(self, snapshot):
+        # Folds in the snapshot of another process, e.g. a sharded worker.
+        with self.lock:
+            for name, series in snapshot["counters"].items():
+                counters = self.counters.setdefault(name, {})
+                for sample in series:
+                    key = label_key(sample["labels"])
+                    counters[key] = counters.get(key, 0) + sample["value"]
+            for name, series in snapshot["histograms"].items():
+                histograms = self.histograms.setdefault(name, {})
+                for sample in series:
+                    key = label_key(sample["labels"])
+                    if key not in histograms:
+                        histograms[key] = Histogram(tuple(sample["buckets"]))
+                    histograms[key].merge(sample)
+            self.traces.merge(snapshot["traces"])
+
+    def summary(self):
+        # The JSON export: raw series plus p50/p99 per histogram.
+        report = self.snapshot()
+        with self.lock:
+            for name, series in self.histograms.items():
+                for sample, histogram in zip(report["histograms"][name], series.values()):
+                    sample["p50"] = histogram.quantile(0.5)
+                    sample["p99"] = histogram.quantile(0.99)
+            report["traces"]["p50"] = self.traces.latency.quantile(0.5)
+            report["traces"]["p99"] = self.traces.latency.quantile(0.99)
+        return report
+
+    def to_json(self):
+        return json.dumps(self.summary(), ensure_ascii=False, indent=4)
+
+    def to_prometheus(self, prefix="cascadener_"):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}{name} counter")
+                for key, value in series.items():
+                    lines.append(f"{prefix}{name}{format_labels(key)} {value}")
+            histograms = sorted(self.histograms.items())
+            histograms.append(("sentence_seconds", {(): self.traces.latency}))
+            for name, series in histograms:
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{prefix}{name}_bucket{format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{prefix}{name}_bucket{format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{prefix}{name}_sum{format_labels(key)} {histogram.sum}")
+                    lines.append(f"{prefix}{name}_count{format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_file=None, prometheus_file=None):
+        if json_file:
+            with open(json_file, 'w', encoding='utf-8') as f:
+                f.write(self.to_json())
+        if prometheus_file:
+            with open(prometheus_file, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+
+metrics = Metrics()
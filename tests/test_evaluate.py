@@ -0,0 +1,49 @@
+import pytest
+
+from evaluate import calculate_entity_metrics, calculate_metrics, evaluate_records, iter_common_records
+
+def record(entities, categories):
+    return {"sentence": " ".join(entities), "entity": entities, "category": categories}
+
+TRUE = {
+    "s1": record(["Paris", "Alice"], ["location", "person"]),
+    "s2": record(["Bob"], ["person"]),
+    "s3": record(["Rome"], ["location"]),
+}
+PRED = {
+    # (alice, location) is in no gold set, so only strict counts it
+    "s1": record(["Paris", "Alice"], ["location", "location"]),
+    # (rome, location) is gold elsewhere, so it is a false positive here
+    "s2": record(["Bob", "Rome"], ["person", "location"]),
+    "s3": record([], []),
+    "s4": record(["Nowhere"], ["location"]),
+}
+
+def test_micro_scores_ignore_pairs_outside_the_gold_vocabulary():
+    # tp: (paris, location), (bob, person); fp: (rome, location) in s2;
+    # fn: (alice, person), (rome, location) in s3
+    assert calculate_metrics(TRUE, PRED) == pytest.approx((2 / 3, 2 / 4, 4 / 7), abs=0)
+    # tp: paris, alice, bob; fp: rome in s2; fn: rome in s3
+    assert calculate_entity_metrics(TRUE, PRED) == pytest.approx((3 / 4, 3 / 4, 6 / 8), abs=0)
+
+def test_strict_counts_every_predicted_pair():
+    report = evaluate_records(iter_common_records(TRUE, PRED), strict=True)
+    assert report["sentences"] == 3
+    assert report["micro"] == {"precision": 2 / 4, "recall": 2 / 4, "f1": 4 / 8}
+
+def test_per_category_and_macro_scores():
+    report = evaluate_records(iter_common_records(TRUE, PRED))
+    assert report["per_category"] == {
+        "location": {"precision": 1 / 2, "recall": 1 / 2, "f1": 2 / 4, "support": 2},
+        "person": {"precision": 1.0, "recall": 1 / 2, "f1": 2 / 3, "support": 2},
+    }
+    assert report["macro"]["f1"] == pytest.approx((2 / 4 + 2 / 3) / 2)
+
+def test_empty_gold_scores_zero():
+    true_data = {"s1": record([], [])}
+    pred_data = {"s1": record(["Paris"], ["location"])}
+    assert calculate_metrics(true_data, pred_data) == (0.0, 0.0, 0.0)
+    assert calculate_entity_metrics(true_data, pred_data) == (0.0, 0.0, 0.0)
+    report = evaluate_records(iter_common_records(true_data, pred_data), strict=True)
+    assert report["micro"] == {"precision": 0.0, "recall": 0.0, "f1": 0.0}
+    assert report["per_category"] == {"location": {"precision": 0.0, "recall": 0.0, "f1": 0.0, "support": 0}}
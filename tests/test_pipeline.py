@@ -0,0 +1,66 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from backends import FakeBackend
+from category_hierarchy import load_category_hierarchy
+from infer import extract_responses, iter_windows, label_window
+from pipeline import PipelinedRunner
+
+ROOT = Path(__file__).resolve().parents[1]
+GOLD = str(ROOT / "DynamicNER" / "example.json")
+CATEGORIES = str(ROOT / "DynamicNER" / "DynamicNER.json")
+
+def load_queries(limit):
+    with open(GOLD, "r", encoding="utf-8") as f:
+        return list(dict.fromkeys(record["sentence"] for record in json.load(f).values()))[:limit]
+
+def serial_run(queries, window, repeat):
+    backend1 = FakeBackend(GOLD, CATEGORIES)
+    backend2 = FakeBackend(GOLD, CATEGORIES)
+    hierarchy = load_category_hierarchy(CATEGORIES)
+    return [
+        label_window(list(extract_responses(backend1, chunk, repeat, len(chunk))), backend2, hierarchy)
+        for chunk in iter_windows(queries, window)
+    ]
+
+def test_pipelined_runner_matches_serial_run():
+    queries = load_queries(120)
+    window = 4
+    repeat = 2
+    # per-prompt latency lets windows overtake each other across workers
+    backend1 = FakeBackend(GOLD, CATEGORIES, prompt_latency=0.0005)
+    backend2 = FakeBackend(GOLD, CATEGORIES, prompt_latency=0.0005)
+    hierarchy = load_category_hierarchy(CATEGORIES)
+    runner = PipelinedRunner(
+        lambda chunk: list(extract_responses(backend1, chunk, repeat, len(chunk))),
+        lambda records: label_window(records, backend2, hierarchy),
+        extract_workers=3,
+        classify_workers=3,
+        queue_size=2,
+    )
+
+    pipelined = list(runner.run(iter_windows(queries, window)))
+
+    assert pipelined == serial_run(queries, window, repeat)
+    report = runner.report()
+    assert report["extract"]["windows"] == report["classify"]["windows"] == len(pipelined)
+
+def test_pipelined_runner_raises_worker_errors():
+    def fail(records):
+        raise RuntimeError("classifier failed")
+
+    runner = PipelinedRunner(lambda chunk: chunk, fail, queue_size=1)
+    with pytest.raises(RuntimeError, match="classifier failed"):
+        list(runner.run(iter_windows(range(10), 2)))
+
+def test_fake_drop_rate_is_independent_of_call_order():
+    queries = load_queries(40)
+    in_order = FakeBackend(GOLD, CATEGORIES, drop_rate=0.3).sample(queries, 3)
+    backend = FakeBackend(GOLD, CATEGORIES, drop_rate=0.3)
+    with ThreadPoolExecutor(4) as pool:
+        shuffled = list(pool.map(lambda query: backend.sample([query], 3)[0], reversed(queries)))
+    assert in_order == shuffled[::-1]
+    assert any(len(set(responses)) > 1 for responses in in_order)
@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+from backends import FakeBackend
+from infer import default_settings, run_inference
+from output_writer import iter_jsonl_records
+
+ROOT = Path(__file__).resolve().parents[1]
+GOLD = str(ROOT / "DynamicNER" / "example.json")
+CATEGORIES = str(ROOT / "DynamicNER" / "DynamicNER.json")
+
+def make_settings(tmp_path, queries=200):
+    # swift results of one run over the first `queries` gold sentences
+    with open(GOLD, "r", encoding="utf-8") as f:
+        sentences = list(dict.fromkeys(record["sentence"] for record in json.load(f).values()))[:queries]
+    infer_result_dir = tmp_path / "infer_result"
+    infer_result_dir.mkdir()
+    with open(infer_result_dir / "run0.jsonl", "w", encoding="utf-8") as f:
+        for sentence, response in zip(sentences, FakeBackend(GOLD, CATEGORIES).generate(sentences)):
+            f.write(json.dumps({"query": sentence, "response": response}, ensure_ascii=False) + "\n")
+    settings = default_settings()
+    settings.update(
+        backend="fake", fake_gold_path=GOLD, category_file_path=CATEGORIES, local_model_path2=str(tmp_path / "classifier"),
+        extractor="swift", infer_result_dir=str(infer_result_dir), repeat=1, window=4, cache_path=None,
+        stream_file=str(tmp_path / "output.jsonl"), checkpoint_file=str(tmp_path / "output.ckpt"),
+    )
+    return settings
+
+def read_output(settings):
+    return list(iter_jsonl_records(settings["stream_file"]))
+
+def test_resume_after_limit_matches_a_full_run(tmp_path):
+    settings = make_settings(tmp_path)
+    run_inference(dict(settings, limit=-1, resume=False))
+    full = read_output(settings)
+
+    run_inference(dict(settings, limit=50, resume=False))
+    assert len(read_output(settings)) == 49
+    checkpoint_size = Path(settings["checkpoint_file"]).stat().st_size
+    # rerunning with the same limit neither writes nor checkpoints anything
+    run_inference(dict(settings, limit=50))
+    assert len(read_output(settings)) == 49
+    assert Path(settings["checkpoint_file"]).stat().st_size == checkpoint_size
+
+    run_inference(dict(settings, limit=-1))
+    assert read_output(settings) == full
+
+def test_resume_starts_over_for_other_inputs(tmp_path):
+    settings = make_settings(tmp_path)
+    run_inference(dict(settings, limit=-1))
+    full = read_output(settings)
+
+    categories = tmp_path / "categories.json"
+    with open(CATEGORIES, "r", encoding="utf-8") as f:
+        category_data = json.load(f, strict=False)
+    category_data["dataset"] = "changed"
+    categories.write_text(json.dumps(category_data), encoding="utf-8")
+    run_inference(dict(settings, limit=10, category_file_path=str(categories)))
+    assert len(read_output(settings)) == 9
+    assert len(full) > 9
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("uvicorn")
+from fastapi.testclient import TestClient
+
+from service import MicroBatcher, NerEngine, create_app
+
+SENTENCES = [f"Sentence {index} mentions Paris and Alice{index}" for index in range(12)]
+
+def stub_engine(calls, closed):
+    # capitalized words are entities, every entity is a "location"
+    def extract(sentences):
+        calls["extract"].append(len(sentences))
+        return [
+            [{"text": word, "support": 1} for word in sentence.split() if word[0].isupper()]
+            for sentence in sentences
+        ]
+
+    def classify(items):
+        calls["classify"].append(len(items))
+        time.sleep(0.01)
+        return [["location"] * len(entities_text) for entities_text, _ in items]
+
+    return NerEngine(extract, classify, max_batch=16, max_wait=0.05, close_fn=lambda: closed.append(True))
+
+def test_ner_streams_entities_in_order_and_coalesces_batches():
+    calls = {"extract": [], "classify": []}
+    closed = []
+    with TestClient(create_app(stub_engine(calls, closed))) as client:
+        response = client.post("/ner", json={"sentences": SENTENCES})
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        stats = client.get("/stats").json()
+
+    events = [line["event"] for line in lines]
+    assert events == ["entities"] * len(SENTENCES) + ["categories"] * len(SENTENCES)
+    entities = lines[:len(SENTENCES)]
+    assert [line["index"] for line in entities] == list(range(len(SENTENCES)))
+    assert [line["sentence"] for line in entities] == SENTENCES
+    categories = sorted(lines[len(SENTENCES):], key=lambda line: line["index"])
+    for index, line in enumerate(categories):
+        assert line["sentence"] == SENTENCES[index]
+        assert line["entity"] == ["Sentence", "Paris", f"Alice{index}"]
+        assert line["category"] == ["location"] * 3
+
+    # one request's sentences share model calls instead of one call each
+    assert sum(calls["extract"]) == len(SENTENCES) and len(calls["extract"]) < len(SENTENCES)
+    assert sum(calls["classify"]) == len(SENTENCES) and len(calls["classify"]) < len(SENTENCES)
+    assert stats["extract"]["items"] == len(SENTENCES)
+    assert closed == [True]
+
+def test_classify_skips_the_model_without_entities():
+    calls = {"extract": [], "classify": []}
+    with TestClient(create_app(stub_engine(calls, []))) as client:
+        response = client.post("/classify", json={"sentence": "nothing here", "entities": []})
+    assert response.json() == {"sentence": "nothing here", "entity": [], "category": []}
+    assert calls["classify"] == []
+
+def test_micro_batcher_buckets_by_length_and_flushes_on_the_deadline():
+    batches = []
+
+    def record(items):
+        batches.append(items)
+        return [len(item) for item in items]
+
+    async def submit_all():
+        batcher = MicroBatcher(record, max_batch=4, max_wait=0.05, length_fn=len, max_batch_tokens=500)
+        batcher.start()
+        items = ["x" * 2, "x" * 200, "x" * 3, "x" * 201, "x" * 4]
+        results = await asyncio.gather(*[batcher.submit(item) for item in items])
+        await batcher.stop()
+        return items, results
+
+    items, results = asyncio.run(submit_all())
+    assert results == [len(item) for item in items]
+    # no bucket fills up, so all go out on the deadline; padding the short
+    # prompts to 200 would pass max_batch_tokens, so they stay apart
+    assert sorted(sorted(len(item) for item in batch) for batch in batches) == [[2, 3, 4], [200, 201]]
@@ -0,0 +1,62 @@
+from telemetry import metrics
+
+class TraversalPlanner:
+    # Walks the entities of one or more sentences down the category hierarchy
+    # a level at a time and decides which of them still need the classifier:
+    # a parent with a single child resolves without a model call, an entity
+    # whose label is a leaf of the hierarchy keeps that label (the other
+    # entities of the sentence go on), and nothing goes below max_depth. An
+    # answer outside the offered list leaves its entity unlabelled (None).
+    def __init__(self, hierarchy, items, max_depth=None):
+        # items: one list of entities per sentence
+        self.hierarchy = hierarchy
+        self.depth = hierarchy.depth if max_depth is None else max(1, min(max_depth, hierarchy.depth))
+        self.labels = [[None] * len(entities) for entities in items]
+        self.active = [(item, entity) for item, entities in enumerate(items) for entity in range(len(entities))]
+        # model calls a full walk of every entity would have made but this one skips
+        self.saved = {"single_child": 0, "stopped": 0, "max_depth": 0}
+        self.invalid = 0
+
+    def levels(self):
+        return list(enumerate(self.hierarchy.ordinals[:self.depth]))
+
+    def plan(self, depth):
+        # Returns [(item, entity, label list, candidates)] that need the model
+        # at this depth, after resolving the deterministic ones.
+        queries = []
+        active = []
+        for item, entity in self.active:
+            parent = self.labels[item][entity]
+            candidates = self.hierarchy.candidates(depth, parent)
+            if not candidates:
+                self.saved["stopped"] += self.hierarchy.depth - depth
+                continue
+            active.append((item, entity))
+            if len(candidates) == 1:
+                self.labels[item][entity] = candidates[0]
+                self.saved["single_child"] += 1
+            else:
+                queries.append((item, entity, self.hierarchy.prompt(depth, parent), candidates))
+        self.active = active
+        return queries
+
+    def resolve(self, queries, labels):
+        invalid = set()
+        for (item, entity, _, candidates), label in zip(queries, labels):
+            if label in candidates:
+                self.labels[item][entity] = label
+            else:
+                self.labels[item][entity] = None
+                invalid.add((item, entity))
+        if invalid:
+            self.invalid += len(invalid)
+            self.active = [key for key in self.active if key not in invalid]
+
+    def finish(self):
+        self.saved["max_depth"] += len(self.active) * (self.hierarchy.depth - self.depth)
+        for reason, count in self.saved.items():
+            if count:
+                metrics.inc("classifier_calls_saved_total", count, reason=reason)
+        if self.invalid:
+            metrics.inc("classifier_invalid_labels_total", self.invalid)
+        return self.labels